@@ -0,0 +1,11 @@
+"""
+Puts the modules shared by a3 and final (ballot matrices, pairwise counts,
+eliminations, generators, STV counts, tallies and tracing) on the import
+path. They live once in ../common, import this before any of them.
+"""
+import sys
+from os import path
+
+COMMON = path.join(path.dirname(path.dirname(path.abspath(__file__))), "common")
+if COMMON not in sys.path:
+    sys.path.append(COMMON)
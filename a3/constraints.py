@@ -0,0 +1,338 @@
+import json
+from fractions import Fraction
+from math import floor, ceil
+import numpy as np
+
+
+class Constraint:
+    """
+    Linear constraint coefficients . x + difference <= 0, x[t] is the number of
+    manipulators of type t: voters casting the t-th ballot of the profile who cast
+    the manipulators' ballot instead. Every type in add adds one to its
+    coefficient, every type in subtract takes one off.
+    """
+    def __init__(self, add, subtract, difference, nr_types=None) -> None:
+        if nr_types is None:
+            nr_types = max(list(add) + list(subtract), default=-1) + 1
+        self.coefficients = np.zeros(nr_types, dtype=np.int64)
+        np.add.at(self.coefficients, list(add), 1)
+        np.subtract.at(self.coefficients, list(subtract), 1)
+        self.difference = difference
+
+    @classmethod
+    def from_coefficients(cls, coefficients, difference):
+        constraint = cls((), (), difference, len(coefficients))
+        constraint.coefficients = np.asarray(coefficients, dtype=np.int64)
+        return constraint
+
+    @property
+    def add(self):
+        return np.repeat(np.arange(len(self.coefficients)), np.maximum(self.coefficients, 0)).tolist()
+
+    @property
+    def subtract(self):
+        return np.repeat(np.arange(len(self.coefficients)), np.maximum(-self.coefficients, 0)).tolist()
+
+    def bound(self):
+        """
+        Largest value coefficients . x can take, rounded down as x holds whole numbers of voters
+        """
+        return floor(-self.difference)
+
+    def check_constraint(self, x):
+        """
+        x: list of ints or Fractions
+        """
+        return sum(a * v for a, v in zip(self.coefficients.tolist(), x)) + self.difference <= 0
+
+    def string(self, labels=None) -> str:
+        """
+        labels: list of strings (name of every type), default a, b, c...
+        """
+        label = (lambda t: chr(ord('a') + t)) if labels is None else labels.__getitem__
+        add = [label(a) for a in self.add]
+        subtract = [label(a) for a in self.subtract]
+        return f"{add} - {subtract} <= {-self.difference}"
+
+
+class ConstraintPath:
+    """
+    Constraints along a path of STV_tree. A node only holds the constraints added
+    on its own edge and points to its parent, so all paths share their common
+    prefix instead of each holding a copy of it. A node also keeps the point that
+    showed its path feasible, which its children try first.
+    """
+    def __init__(self, parent=None, constraints=()) -> None:
+        self.parent = parent
+        self.constraints = list(constraints)
+        self.length = len(self.constraints) + (0 if parent is None else parent.length)
+        self.point = UNSOLVED                                   # See feasible_point
+
+    def extend(self, constraints):
+        return ConstraintPath(self, constraints) if len(constraints) > 0 else self
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        nodes = []
+        node = self
+        while node is not None:
+            nodes.append(node)
+            node = node.parent
+        for node in reversed(nodes):
+            yield from node.constraints
+
+    def feasible_point(self, nr_types, upper=None):
+        """
+        Some x >= 0 (and x <= upper) meeting every constraint of the path, with real
+        values (see solve_feasible), so a path without one is infeasible. Points are
+        cached on the nodes, upper has to be the same for every node of a tree. A node
+        reuses the point of its parent when that meets its own constraints as well,
+        which costs one pass over a few rows, only otherwise the whole path is solved.
+        output:
+            x: list of ints or Fractions, None if there is none
+        """
+        if self.point is UNSOLVED:
+            start = [0] * nr_types if self.parent is None else self.parent.feasible_point(nr_types, upper)
+            if start is None:
+                self.point = None                               # A longer path cannot be feasible either
+            elif all(constraint.check_constraint(start) for constraint in self.constraints):
+                self.point = start
+            else:
+                self.point = solve_feasible(*self.system(nr_types), upper)
+        return self.point
+
+    def system(self, nr_types):
+        """
+        All constraints of the path as A x <= b
+        output:
+            A: int matrix (one row of coefficients per constraint)
+            b: int array (bounds)
+        """
+        A = np.zeros((self.length, nr_types), dtype=np.int64)
+        b = np.zeros(self.length, dtype=np.int64)
+        for row, constraint in enumerate(self):
+            A[row, :len(constraint.coefficients)] = constraint.coefficients
+            b[row] = constraint.bound()
+        return A, b
+
+
+UNSOLVED = object()
+
+
+def as_path(constraints):
+    return constraints if isinstance(constraints, ConstraintPath) else ConstraintPath(None, constraints)
+
+
+def reduce_system(A, b):
+    """
+    Remove redundant rows of A x <= b (x >= 0): rows are divided by the gcd of their
+    coefficients, rows that always hold are dropped, of equal rows only the tightest
+    is kept, and so is every row implied by a single other row (a <= a' and b' <= b)
+    output:
+        A, b: the remaining rows
+    """
+    A = np.asarray(A, dtype=np.int64)
+    b = np.asarray(b, dtype=np.int64)
+    divisor = np.gcd.reduce(np.abs(A), axis=1) if A.shape[1] > 0 else np.zeros(len(A), dtype=np.int64)
+    divisor[divisor == 0] = 1
+    A, b = A // divisor[:, None], np.floor_divide(b, divisor)
+
+    necessary = ~((A <= 0).all(axis=1) & (b >= 0))              # Holds for every x >= 0
+    A, b = A[necessary], b[necessary]
+
+    tightest = {}
+    for row, bound in zip(map(tuple, A.tolist()), b.tolist()):
+        tightest[row] = min(bound, tightest.get(row, bound))
+    if len(tightest) == 0:
+        return np.zeros((0, A.shape[1]), dtype=np.int64), np.zeros(0, dtype=np.int64)
+    A = np.array(list(tightest.keys()), dtype=np.int64)
+    b = np.array(list(tightest.values()), dtype=np.int64)
+
+    implied = (A[:, None, :] <= A[None, :, :]).all(axis=2) & (b[None, :] <= b[:, None])
+    np.fill_diagonal(implied, False)
+    keep = ~implied.any(axis=1)
+    return A[keep], b[keep]
+
+
+def solve_feasible(A, b, upper=None):
+    """
+    Some x >= 0 (and x <= upper) with A x <= b, with real values, after every row was
+    rounded for whole numbers of voters by reduce_system. Types whose columns are
+    equal only count together, so they become one variable, bounded by their summed
+    upper bounds, and share its value in proportion to their own bounds. A row that
+    cannot hold anywhere in the box 0 <= x <= upper rules the system out before the
+    simplex runs.
+    output:
+        x: list of ints or Fractions, None if there is none
+    """
+    A, b = reduce_system(A, b)
+    columns, group = np.unique(A, axis=1, return_inverse=True)
+    group = group.reshape(-1).tolist()
+    if upper is None:
+        if ((A >= 0).all(axis=1) & (b < 0)).any():
+            return None
+        y = simplex(columns.tolist(), b.tolist(), [0] * columns.shape[1])
+        if y is None:
+            return None
+        first = {}
+        return [y[g] if first.setdefault(g, t) == t else 0 for t, g in enumerate(group)] # The first type takes it all
+
+    upper = np.asarray(upper, dtype=np.int64)
+    if ((np.minimum(A, 0) * upper).sum(axis=1) > b).any():
+        return None
+    bounds = np.bincount(group, weights=upper, minlength=columns.shape[1]).astype(np.int64).tolist()
+    rows = np.vstack([columns, np.eye(columns.shape[1], dtype=np.int64)])
+    y = simplex(rows.tolist(), b.tolist() + bounds, [0] * columns.shape[1])
+    if y is None:
+        return None
+    return [y[g] * Fraction(u, bounds[g]) if bounds[g] > 0 else 0 for g, u in zip(group, upper.tolist())]
+
+
+def feasible(constraints, upper=None):
+    """
+    Whether a ConstraintPath (or list of Constraints) can all hold at once, for
+    x >= 0 with real values (see solve_feasible)
+    input:
+        upper: list of ints (most manipulators available of each type), optional
+    """
+    path = as_path(constraints)
+    nr_types = len(upper) if upper is not None else max((len(constraint.coefficients) for constraint in path), default=0)
+    return path.feasible_point(nr_types, upper) is not None
+
+
+def simplex(A, b, c):
+    """
+    Minimise c . x subject to A x <= b and x >= 0 (c >= 0, so it is bounded), exactly
+    with fractions, in two phases with Bland's rule
+    output:
+        x: list of Fractions, None if infeasible
+    """
+    m, n = len(A), len(c)
+    slacks = m
+    negative = [i for i in range(m) if b[i] < 0]
+    width = n + m + len(negative)                               # x, slacks, artificials
+    tableau, basis = [], []
+    for i in range(m):
+        sign = -1 if b[i] < 0 else 1
+        row = [Fraction(sign * int(a)) for a in A[i]] + [Fraction(0)] * (width - n) + [Fraction(sign * int(b[i]))]
+        row[n + i] = Fraction(sign)
+        if sign < 0:
+            artificial = n + m + negative.index(i)
+            row[artificial] = Fraction(1)
+            basis.append(artificial)
+        else:
+            basis.append(n + i)
+        tableau.append(row)
+
+    def pivot(r, col):
+        tableau[r] = [v / tableau[r][col] for v in tableau[r]]
+        for i in range(m):
+            if i != r and tableau[i][col] != 0:
+                factor = tableau[i][col]
+                tableau[i] = [v - factor * p for v, p in zip(tableau[i], tableau[r])]
+        basis[r] = col
+
+    def optimise(cost, columns):
+        # Reduced costs as one more row, updated by every pivot instead of recomputed from the tableau
+        reduced = list(cost) + [0]
+        for i in range(m):
+            if cost[basis[i]] != 0:
+                reduced = [v - cost[basis[i]] * p for v, p in zip(reduced, tableau[i])]
+        while True:
+            entering = next((j for j in range(columns) if reduced[j] < 0), None)
+            if entering is None:
+                return
+            ratios = [(tableau[i][-1] / tableau[i][entering], basis[i], i) for i in range(m) if tableau[i][entering] > 0]
+            _, _, r = min(ratios)                               # Bounded: some row limits the entering column
+            pivot(r, entering)
+            factor = reduced[entering]
+            reduced = [v - factor * p for v, p in zip(reduced, tableau[r])]
+
+    if len(negative) > 0:
+        optimise([0] * (n + m) + [1] * len(negative), width)
+        if any(tableau[i][-1] != 0 for i in range(m) if basis[i] >= n + m):
+            return None
+        for r in range(m):                                      # Drive artificials at level 0 out of the basis
+            if basis[r] >= n + m:
+                col = next((j for j in range(n + m) if tableau[r][j] != 0), None)
+                if col is not None:
+                    pivot(r, col)
+        keep = [r for r in range(m) if basis[r] < n + m]        # Rows left with an artificial are redundant
+        tableau[:] = [tableau[r] for r in keep]
+        basis[:] = [basis[r] for r in keep]
+        m = len(keep)
+    optimise([Fraction(v) for v in c] + [0] * (width - n), n + slacks)
+
+    x = [Fraction(0)] * n
+    for i in range(m):
+        if basis[i] < n:
+            x[basis[i]] = tableau[i][-1]
+    return x
+
+
+def minimal_manipulators(A, b, upper=None):
+    """
+    Smallest total number of manipulators, and how many of them must be of each
+    type, such that A x <= b. Branch and bound over exact LP relaxations.
+    input:
+        A: int matrix, b: int array (see ConstraintPath.system)
+        upper: list of ints (most manipulators available of each type), optional
+    output:
+        x: list of ints, None if no number of manipulators works
+    """
+    A, b = reduce_system(A, b)
+    n = A.shape[1]
+    if upper is not None:
+        A = np.vstack([A, np.eye(n, dtype=np.int64)])
+        b = np.concatenate([b, np.asarray(upper, dtype=np.int64)])
+    best, best_total = None, None
+    stack = [(A.tolist(), b.tolist())]
+    while len(stack) > 0:
+        rows, bounds = stack.pop()
+        x = simplex(rows, bounds, [1] * n)
+        if x is None or (best_total is not None and ceil(sum(x)) >= best_total):
+            continue
+        fractional = next((j for j in range(n) if x[j].denominator != 1), None)
+        if fractional is None:
+            best, best_total = [int(v) for v in x], int(sum(x))
+            continue
+        unit = [0] * n
+        unit[fractional] = 1
+        stack.append((rows + [[-v for v in unit]], bounds + [-ceil(x[fractional])]))
+        stack.append((rows + [unit], bounds + [floor(x[fractional])]))
+    return best
+
+
+def export_leaves(results, nr_types, filename):
+    """
+    Write the leaves of STV_tree as JSON lines (reduced A x <= b per leaf),
+    so large trees can be solved elsewhere and in parallel with solve_leaf
+    """
+    with open(filename, "w") as f:
+        for winner, constraints, eliminations, ballot in results:
+            A, b = reduce_system(*as_path(constraints).system(nr_types))
+            f.write(json.dumps({
+                "winner": int(winner),
+                "eliminations": [int(c) for c in eliminations],
+                "ballot": [int(c) for c in ballot],
+                "types": nr_types,
+                "A": A.tolist(),
+                "b": b.tolist()
+            }) + "\n")
+
+
+def load_leaves(filename):
+    with open(filename) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def solve_leaf(leaf):
+    """
+    Copy of an exported leaf with the minimal manipulators added, can run in a worker process
+    """
+    A = np.array(leaf["A"], dtype=np.int64).reshape(len(leaf["A"]), leaf["types"])
+    leaf = dict(leaf)
+    leaf["manipulators"] = minimal_manipulators(A, np.array(leaf["b"], dtype=np.int64))
+    return leaf
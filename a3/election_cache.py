@@ -0,0 +1,210 @@
+import hashlib
+import json
+import mmap
+import os
+import struct
+from array import array
+from preflib import PreflibFile
+from profiles import WeightedProfile
+
+# Sidecar layout (little endian, every section starts 8-byte aligned):
+#   header:     magic, source mtime_ns, source size, source digest,
+#               nr_ballots, nr_entries, length of the names table
+#   weights:    int64[nr_ballots]       number of voters per distinct ballot
+#   offsets:    int64[nr_ballots + 1]   start of each ballot in candidates
+#   candidates: int32[nr_entries]       candidate ids, a candidate tied with
+#                                       the previous entry is stored as -(c + 1)
+#   names:      utf-8 json with the candidate names and the file metadata
+MAGIC = b"PLCACHE1"
+HEADER = struct.Struct("<8sqq32sqqq")
+SUFFIX = ".cache"
+
+
+def file_digest(filename):
+    """
+    Hash the contents of a file in chunks
+    """
+    digest = hashlib.blake2b(digest_size=32)
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.digest()
+
+
+def padding(nr_bytes):
+    return -nr_bytes % 8
+
+
+class CachedElection:
+    """
+    Read-only, memory-mapped view of a sidecar written by write_cache.
+    weights, offsets and candidates are memoryviews straight into the mapped
+    pages, so several processes loading the same file share them.
+    """
+    def __init__(self, cache_path) -> None:
+        with open(cache_path, 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.weights = self.offsets = self.candidates = None
+        try:
+            self.read(cache_path)
+        except Exception:
+            self.close()                                        # Nothing stays mapped when the sidecar is unusable
+            raise
+
+    def read(self, cache_path):
+        magic, self.mtime, self.size, self.digest, nr_ballots, nr_entries, names_length = HEADER.unpack_from(self.mm)
+        if magic != MAGIC:
+            raise ValueError(f"{cache_path} is not an election cache")
+        end = HEADER.size + 8 * nr_ballots + 8 * (nr_ballots + 1) + 4 * nr_entries + padding(4 * nr_entries) + names_length
+        if min(nr_ballots, nr_entries, names_length) < 0 or end > len(self.mm):
+            raise ValueError(f"{cache_path} is truncated")
+
+        view = memoryview(self.mm)
+        try:
+            start = HEADER.size
+            self.weights = view[start:start + 8 * nr_ballots].cast('q')
+            start += 8 * nr_ballots
+            self.offsets = view[start:start + 8 * (nr_ballots + 1)].cast('q')
+            start += 8 * (nr_ballots + 1)
+            self.candidates = view[start:start + 4 * nr_entries].cast('i')
+            start += 4 * nr_entries + padding(4 * nr_entries)
+            table = json.loads(bytes(view[start:start + names_length]).decode("utf-8"))
+        finally:
+            view.release()
+        self.names = {int(k): v for k, v in table["names"].items()}
+        self.metadata = table["metadata"]
+
+    def __len__(self):
+        return len(self.weights)
+
+    def ballot(self, idx):
+        """
+        Decode a single ballot, tie groups as lists of ints
+        """
+        ballot = []
+        for c in self.candidates[self.offsets[idx]:self.offsets[idx + 1]]:
+            if c >= 0:
+                ballot.append(c)
+            elif type(ballot[-1]) == list:
+                ballot[-1].append(-c - 1)
+            else:
+                ballot[-1] = [ballot[-1], -c - 1]
+        return ballot
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self.ballot(idx), self.weights[idx]
+
+    def profile(self):
+        return WeightedProfile([self.ballot(idx) for idx in range(len(self))], self.weights.tolist())
+
+    def close(self):
+        for view in (self.weights, self.offsets, self.candidates):
+            if view is not None:
+                view.release()
+        self.mm.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def write_cache(cache_path, source, data, names, metadata):
+    """
+    Write a parsed election to a binary sidecar
+    input:
+        cache_path: string (path of the sidecar)
+        source: string (path of the PrefLib file the election was parsed from)
+        data: WeightedProfile (voters' votes)
+        names: dict of ints to strings (candidate names)
+        metadata: dict of strings (PrefLib header fields)
+    """
+    stat = os.stat(source)
+    weights = array('q', data.weights)
+    offsets = array('q', [0])
+    candidates = array('i')
+    for ballot in data.ballots:
+        for candidate in ballot:
+            if type(candidate) == list:
+                candidates.append(candidate[0])
+                candidates.extend(-c - 1 for c in candidate[1:])
+            else:
+                candidates.append(candidate)
+        offsets.append(len(candidates))
+    table = json.dumps({"names": names, "metadata": metadata}).encode("utf-8")
+
+    # Write next to the final location and swap it in, so readers never see
+    # a half written file and existing mappings of the old one stay valid
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, stat.st_mtime_ns, stat.st_size, file_digest(source),
+                            len(weights), len(candidates), len(table)))
+        f.write(weights.tobytes())
+        f.write(offsets.tobytes())
+        f.write(candidates.tobytes())
+        f.write(b"\0" * padding(4 * len(candidates)))
+        f.write(table)
+    os.replace(tmp_path, cache_path)
+
+
+def open_cache(source):
+    """
+    Open the sidecar of a PrefLib file if it is still up to date
+    input:
+        source: string (path of the PrefLib file)
+    output:
+        election: CachedElection, or None if the sidecar is missing or stale
+    """
+    cache_path = source + SUFFIX
+    if not os.path.exists(cache_path):
+        return None
+    try:
+        election = CachedElection(cache_path)
+    except (ValueError, TypeError, struct.error):
+        return None                                             # Damaged sidecar, parse the file again
+
+    # Matching mtime and size is enough, otherwise fall back to the content hash
+    stat = os.stat(source)
+    if (election.mtime, election.size) == (stat.st_mtime_ns, stat.st_size):
+        return election
+    if election.size == stat.st_size and election.digest == file_digest(source):
+        try:
+            with open(cache_path, 'r+b') as f:                  # Only touched, remember the new mtime
+                f.seek(len(MAGIC))
+                f.write(struct.pack("<q", stat.st_mtime_ns))
+        except OSError:
+            pass
+        return election
+    election.close()
+    return None
+
+
+def load_cached(source, cache=True):
+    """
+    Load a PrefLib file through its binary sidecar, parsing and writing the
+    sidecar when it is missing or stale
+    input:
+        source: string (path of the PrefLib file)
+        cache: bool (False skips the sidecar entirely)
+    output:
+        data: WeightedProfile (distinct ballots and the number of voters casting them)
+        names: dict of ints to strings (candidate names)
+    """
+    election = open_cache(source) if cache else None
+    if election is not None:
+        with election:
+            return election.profile(), election.names
+
+    data = WeightedProfile()
+    with PreflibFile(source) as parsed:
+        for ballot, nr_voters in parsed:
+            data.add(ballot, nr_voters)
+
+    if cache:
+        try:
+            write_cache(source + SUFFIX, source, data, parsed.names, parsed.metadata)
+        except OSError:
+            pass                                                # Read-only location, just skip the sidecar
+    return data, parsed.names
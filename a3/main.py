@@ -1,48 +1,31 @@
-from os import path, sep, listdir
-import re
+from os import path, sep, listdir, cpu_count
+from multiprocessing import Pool
 import itertools
-import time as t 
+import time as t
+from fractions import Fraction
 import csv
+from profiles import WeightedProfile, OverlayProfile, weighted_ballots, ballots_and_weights, ballot_key
+import common_path
+from stv import STVCount, exact_votes
+from eliminations import Eliminations, as_eliminations
+import tracing
+from ballot_matrix import BallotMatrix
+from election_cache import load_cached
 
 cwd = path.dirname(path.abspath(__file__))
 
 DEBUGGING = False
 
-def load_data(filename="00016-00000001.toi"):
-    """
-    Load data from file
-    """
-    data = []
-    names = {}
-    with open(cwd + sep + filename, 'r') as f:
-        lines = f.readlines()
-        for line in lines:
-            if line.startswith("# ALTERNATIVE"):
-                s = line.split(":")
-                number = int(s[0].split(" ")[-1]) - 1
-                name = s[1].strip()
-                names[number] = name
-            
-            if line.startswith("#"):
-                continue
-            s = line.split(":")
-            nr_voters = int(s[0])
-            votes = []
-            if "{" in s[1]:
-                # Split {...} from the rest
-                new = re.split(r"(\{.*?\})", s[1].strip())
-                new[1] = new[1][1:-1]
-                votes = [int(v) - 1 for v in new[0].split(",") if v != ""]
-                votes += [[int(v) - 1 for v in new[1].split(",") if v != "" if v != "{" if v != "}"]]
-                votes += [int(v) - 1 for v in new[2].split(",") if v != ""]
-
-            else:
-                votes = [int(v) - 1 for v in s[1].strip().split(",")]    
-
-            for _ in range(nr_voters):
-                data.append(votes)
-    
-    return data, names
+def load_data(filename="00016-00000001.toi", cache=True):
+    """
+    Load data from a (possibly compressed) PrefLib .soc/.soi/.toc/.toi file.
+    The parsed election is stored in a binary sidecar next to the file,
+    later loads read that instead of parsing the text again
+    output:
+        data: WeightedProfile (distinct ballots and the number of voters casting them)
+        names: dict of ints to strings (candidate names)
+    """
+    return load_cached(cwd + sep + filename, cache)
 
 
 def tied_vote(vote, eliminations):
@@ -50,47 +33,70 @@ def tied_vote(vote, eliminations):
     Resolve a tied vote
     input:
         vote: list of ints (candidates)
-        eliminations: list of ints (candidates that have been eliminated)
+        eliminations: Eliminations or list of ints (candidates that have been eliminated)
     output:
         vote: list of ints (candidates)"""
 
-    # print(vote)
-    if len(vote) == 1:
-        return None if vote[0] in eliminations else [vote[0]]
-    if vote[0] in eliminations and vote[1] in eliminations:
-        return None
-    if vote[0] in eliminations:
-        return [vote[1]]
-    if vote[1] in eliminations:
-        return [vote[0]]
-    return vote
+    remaining = [c for c in vote if c not in eliminations]      # Tie groups can hold any number of candidates
+    return remaining if len(remaining) > 0 else None
 
-def plurality(data, names, eliminations):
+def vote_count(data, names, eliminations):
     """
-    Plurality voting
+    Count the plurality score of each candidate
     input:
-        data: list of lists of ints (voters' votes)
+        data: WeightedProfile, OverlayProfile, BallotMatrix or list of lists of ints (voters' votes)
         names: dict of ints to strings (candidate names)
-        eliminations: list of ints (candidates that have been eliminated)
+        eliminations: Eliminations or list of ints (candidates that have been eliminated)
     output:
-        winners: list of ints (candidate(s) with most votes)
-        losers: list of ints (candidate(s) with least votes)
+        nr_votes: list of ints (number of votes for each candidate)
     """
+    eliminations = as_eliminations(eliminations)                # O(1) membership for every ballot
+    if isinstance(data, BallotMatrix):
+        return data.first_preferences(eliminations)
+    if isinstance(data, OverlayProfile):
+        return exact_votes(data.first_preferences(eliminations, len(names)))
+
     nr_votes = [0] * len(names)
-    for ballot in data:                                         # For each ballot
+    for ballot, weight in weighted_ballots(data):               # For each ballot
         for candidate in ballot:                                # For first eligible candidate in the vote
             if type(candidate) == list:                         # In case of Split vote
                 result = tied_vote(candidate, eliminations)
-                if result is None:                              # Both candidates were eliminated,
+                if result is None:                              # All tied candidates were eliminated,
                     continue                                    # continue to next candidate in ballot
                 for c in result:
-                    nr_votes[c] += 1/len(result)                # Add weighted vote to one or both candidates
-                    break
-                continue                                        # Both candidates were eliminated, continue to next candidate
+                    nr_votes[c] += Fraction(weight, len(result)) # Split the vote over the remaining tied candidates
+                break
             if candidate not in eliminations:
-                nr_votes[candidate] += 1                        # Add vote to single candidate
+                nr_votes[candidate] += weight                   # Add vote to single candidate
                 break
-    
+
+    return exact_votes(nr_votes)
+
+def plurality(data, names, eliminations):
+    """
+    Plurality voting
+    input:
+        data: WeightedProfile, OverlayProfile, BallotMatrix or list of lists of ints (voters' votes)
+        names: dict of ints to strings (candidate names)
+        eliminations: Eliminations or list of ints (candidates that have been eliminated)
+    output:
+        winners: list of ints (candidate(s) with most votes)
+        losers: list of ints (candidate(s) with least votes)
+    """
+    return plurality_result(vote_count(data, names, eliminations), names, eliminations)
+
+def plurality_result(nr_votes, names, eliminations):
+    """
+    Winners and losers of a plurality round
+    input:
+        nr_votes: list of ints (number of votes for each candidate)
+        names: dict of ints to strings (candidate names)
+        eliminations: Eliminations or list of ints (candidates that have been eliminated)
+    output:
+        winners: list of ints (candidate(s) with most votes)
+        losers: list of ints (candidate(s) with least votes)
+    """
+    eliminations = as_eliminations(eliminations)
     # When debugging, print the number of votes for each candidate
     if DEBUGGING:
         print("\n\nNew Round:")
@@ -102,7 +108,7 @@ def plurality(data, names, eliminations):
                 print(f"{nr_votes[i]} votes")
 
     # Find the winners and losers
-    max_votes = max([i for i in nr_votes if i not in eliminations])               # max(nr_votes) belongs to winner
+    max_votes = max(nr_votes[i] for i in range(len(nr_votes)) if i not in eliminations) # max(nr_votes) belongs to winner
     winners = [i for i in range(len(nr_votes)) if nr_votes[i] == max_votes]       # Find index of winners
     
     # Find the losers
@@ -119,6 +125,16 @@ def plurality(data, names, eliminations):
 
 
 def find_manipulators(data, current_winner = 7, to_win = 4):
+    """
+    Find the ballots that prefer to_win over current_winner
+    input:
+        data: WeightedProfile or list of lists of ints (voters' votes)
+        current_winner: int (candidate currently winning)
+        to_win: int (candidate the manipulators want to win)
+    output:
+        manipulators: list of ints (indexes of the ballots in data, for a
+                      WeightedProfile every voter behind such a ballot manipulates)
+    """
     manipulators = []
     for idx, ballot in enumerate(data):
         if current_winner in ballot and to_win in ballot:
@@ -136,19 +152,330 @@ def manipulate(data, new_vote, manipulators):                         # edit the
 
     return data
 
-def STV(data, names, eliminations=[]):
+
+class Manipulation:
+    """
+    A ballot that makes the target win, as found by find_manipulation
+    ballot: tuple of ints (candidates the manipulators' vote actually counts for, in order)
+    gaps: tuple of sets of ints (candidates already eliminated when ballot[i] was reached,
+          any of them may be listed before ballot[i] without changing the outcome)
+    tail: set of ints (candidates eliminated when the ballot was exhausted), or None if the
+          count ended while the ballot still counted, then anything may follow it
+    """
+    def __init__(self, ballot, gaps, tail) -> None:
+        self.ballot = ballot
+        self.gaps = gaps
+        self.tail = tail
+
+    def ballots(self, allowed, length):
+        """
+        Every ballot of exactly length candidates from allowed that behaves like this one
+        """
+        allowed = set(allowed)
+        def extend(i, prefix):
+            free = length - len(prefix)
+            if i == len(self.ballot):
+                pool = allowed if self.tail is None else allowed & self.tail
+                for rest in itertools.permutations(sorted(pool - set(prefix)), free):
+                    yield prefix + rest
+                return
+            pool = sorted(allowed & self.gaps[i] - set(prefix))
+            for nr_fillers in range(min(free - 1, len(pool)) + 1):
+                for fillers in itertools.permutations(pool, nr_fillers):
+                    yield from extend(i + 1, prefix + fillers + (self.ballot[i],))
+        if all(c in allowed for c in self.ballot) and len(self.ballot) <= length:
+            yield from extend(0, ())
+
+    def __repr__(self) -> str:
+        return f"Manipulation({self.ballot})"
+
+
+class ManipulationSearch:
+    """
+    Search for ballots a coalition of voters can all cast to make a target win STV.
+    Only the coalition's ballot changes, so every trial is an OverlayProfile of the
+    profile without the coalition's voters plus their new ballot: the rest of the
+    profile is tallied once per set of eliminated candidates and the coalition only
+    adds its votes to the candidate its ballot currently counts for. The search
+    follows the STV count and only branches when that candidate is eliminated:
+    every ballot listing the same candidates at those moments gives the same
+    count, so it is explored once.
+    The voters casting the ballot are given as switching, a tuple of (ballot index,
+    number of voters) pairs, so any part of the coalition can be tried; every
+    switching gets a trial number the search is keyed on.
+    Subtrees are memoized on (trial, eliminated candidates, current choice, listed candidates).
+    """
+    def __init__(self, data, names, target, coalition, allowed=None, max_length=None, first=None) -> None:
+        if not isinstance(data, WeightedProfile):
+            data = WeightedProfile(*ballots_and_weights(data))  # Keeps the positions the coalition refers to
+        self.profile = OverlayProfile(data)
+        self.names = names
+        self.target = target
+        self.coalition = list(dict.fromkeys(coalition))
+        self.allowed = set(range(len(names)) if allowed is None else allowed)
+        self.max_length = len(names) if max_length is None else max_length
+        self.first = None if first is None else set(first)     # Candidates the ballot may start with
+        self.groups = {}                                        # Identical coalition ballots, their voters are interchangeable
+        for idx in self.coalition:
+            self.groups.setdefault(ballot_key(data.ballots[idx]), []).append(idx)
+        self.groups = list(self.groups.values())
+        self.trials = {}                                        # Switching voters -> trial number
+        self.overlays = []                                      # Trial number -> (profile without its voters, their number)
+        self.memo = {}
+
+    def nr_voters(self):
+        return sum(self.profile.base.weights[idx] for idx in self.coalition)
+
+    def prefix(self, size):
+        """
+        The first size voters of the coalition, in the order of coalition
+        """
+        switching = []
+        for idx in self.coalition:
+            take = min(size, self.profile.base.weights[idx])
+            if take <= 0:
+                break
+            switching.append((idx, take))
+            size -= take
+        return tuple(switching)
+
+    def subsets(self, size):
+        """
+        Every way to pick size voters of the coalition, voters of identical ballots only counted once
+        """
+        def pick(g, left):
+            if left == 0:
+                yield ()
+                return
+            if g == len(self.groups):
+                return
+            group = self.groups[g]
+            available = sum(self.profile.base.weights[idx] for idx in group)
+            for count in range(min(left, available), -1, -1):
+                taken, rest = [], count
+                for idx in group:                               # Fill the identical ballots in order
+                    take = min(rest, self.profile.base.weights[idx])
+                    if take > 0:
+                        taken.append((idx, take))
+                    rest -= take
+                for more in pick(g + 1, left - count):
+                    yield tuple(taken) + more
+        yield from pick(0, size)
+
+    def valid(self, manipulation):
+        """
+        The ballot lists the target, or there is still room to list it where it does not count
+        """
+        return self.target in manipulation.ballot or (manipulation.tail is None and len(manipulation.ballot) < self.max_length)
+
+    def succeeds(self, switching):
+        """
+        Whether the switching voters can make the target win with some ballot
+        """
+        return any(self.valid(m) for m in self.branch(self.trial(switching)))
+
+    def trial(self, switching):
+        """
+        Trial number of the switching voters, their overlay is made once
+        """
+        if switching not in self.trials:
+            self.trials[switching] = len(self.overlays)
+            self.overlays.append((self.profile.without(dict(switching)), sum(take for _, take in switching)))
+        return self.trials[switching]
+
+    def votes(self, trial, eliminated, top):
+        """
+        Exact votes when the voters of a trial cast a ballot that currently counts for top
+        """
+        overlay, size = self.overlays[trial]
+        if top is not None:
+            overlay = overlay.with_ballot([top], size)          # Only top is left of the ballot at this point
+        return overlay.first_preferences(eliminated, len(self.names))
+
+    def search(self, trial, eliminated, top, listed):
+        """
+        Ways to continue the coalition's ballot from this point of the count
+        input:
+            trial: int (trial number of the voters casting the ballot, see trial)
+            eliminated: frozenset of ints (candidates eliminated so far)
+            top: int (candidate the ballot counts for), None if it does not count
+            listed: frozenset of ints (candidates on the ballot so far)
+        output:
+            manipulations: list of Manipulation (relative to this point)
+        """
+        key = (trial, eliminated, top, listed)
+        if key in self.memo:
+            return self.memo[key]
+
+        nr_votes = self.votes(trial, eliminated, top)
+        winners, losers = plurality_result(exact_votes(nr_votes), self.names, eliminated)
+        if len(losers) == 0:
+            found = [Manipulation((), (), None)] if self.target in winners else []
+        elif self.target in losers:
+            found = []                                          # The target can no longer win
+        else:
+            after = eliminated | frozenset(losers)
+            if top is None or top not in losers:
+                found = self.search(trial, after, top, listed)
+            else:
+                found = self.branch(trial, after, listed)
+        self.memo[key] = found
+        return found
+
+    def branch(self, trial, eliminated=frozenset(), listed=frozenset()):
+        """
+        The ballot's current choice is gone (or it has not started): list the next candidate, or end the ballot here
+        """
+        found = []
+        candidates = self.allowed - eliminated - listed
+        if len(listed) == 0 and self.first is not None:
+            candidates &= self.first                            # Only this shard of the ballots
+        elif len(self.search(trial, eliminated, None, listed)) > 0:
+            found.append(Manipulation((), (), eliminated))
+        if len(listed) < self.max_length:
+            for c in sorted(candidates):
+                for rest in self.search(trial, eliminated, c, listed | {c}):
+                    found.append(Manipulation((c,) + rest.ballot, (eliminated,) + rest.gaps, rest.tail))
+        return found
+
+
+def find_manipulation(data, names, target, coalition, allowed=None, max_length=None, min_coalition=True, first=None):
+    """
+    Every ballot that makes target win STV when all voters of the coalition cast it
+    input:
+        data: WeightedProfile or list of lists of ints (voters' votes)
+        names: dict of ints to strings (candidate names)
+        target: int (candidate the coalition wants to win)
+        coalition: list of ints (indexes of the manipulating ballots in data, see find_manipulators)
+        allowed: list of ints (candidates the ballot may list, default all)
+        max_length: int (maximum number of candidates on the ballot, default all)
+        min_coalition: True to also find the smallest number of coalition voters that can make
+                       target win with some ballot, trying every choice of voters (exponential
+                       in the size of the coalition, meant for small coalitions); "prefix" for
+                       an upper bound on it that only takes voters in the order of coalition;
+                       False for neither
+        first: list of ints (only search ballots starting with one of these candidates)
+    output:
+        manipulations: list of Manipulation (with the full coalition), use
+                       Manipulation.ballots to list the concrete ballots
+        minimum: int (smallest coalition size, or the prefix bound), None if none or not searched
+    """
+    search = ManipulationSearch(data, names, target, coalition, allowed, max_length, first)
+    everyone = search.trial(search.prefix(search.nr_voters()))
+    manipulations = [m for m in search.branch(everyone) if search.valid(m)]
+    minimum = None
+    if min_coalition:
+        for size in range(1, search.nr_voters() + 1):
+            if search.succeeds(search.prefix(size)):
+                minimum = size
+                break
+    if min_coalition is True:
+        # Only sizes below the prefix bound can do better, and only with other voters
+        for size in range(1, search.nr_voters() + 1 if minimum is None else minimum):
+            if any(search.succeeds(switching) for switching in search.subsets(size)):
+                minimum = size
+                break
+    return manipulations, minimum
+
+SEARCH = {}                                                     # Read-only search input of a worker process
+
+
+def init_search(data, names, allowed, max_length, min_coalition=True):
+    SEARCH.update(data=data, names=names, allowed=allowed, max_length=max_length, min_coalition=min_coalition)
+
+
+def search_shard(task):
+    """
+    Search the ballots for one target that start with one candidate
+    input:
+        task: tuple of (target, coalition, first candidate)
+    output:
+        result: tuple of (target, first candidate, manipulations, minimum), see find_manipulation
+    """
+    target, coalition, first = task
+    manipulations, minimum = find_manipulation(SEARCH["data"], SEARCH["names"], target, coalition,
+                                               SEARCH["allowed"], SEARCH["max_length"], SEARCH["min_coalition"], [first])
+    return target, first, manipulations, minimum
+
+
+def parallel_manipulation_search(data, names, coalitions, allowed=None, max_length=None, workers=None, stop_at_first=False, progress=None, min_coalition=True):
+    """
+    find_manipulation for several targets on a process pool, split into one task per
+    target and first candidate of the ballot. The profile is handed to every worker
+    once when it starts, tasks only carry a target, a coalition and a candidate.
+    input:
+        data, names, allowed, max_length, min_coalition: see find_manipulation
+        coalitions: dict of ints to lists of ints (target to its coalition, see find_manipulators)
+        workers: int (number of processes, None for all cores, 1 runs in this process)
+        stop_at_first: bool, cancel the remaining tasks once any task finds a manipulation
+        progress: function called as progress(done, total, target) after every task
+    output:
+        results: dict of ints to (manipulations, minimum) tuples, targets whose tasks were
+                 cancelled are missing or incomplete
+    """
+    first_candidates = sorted(range(len(names)) if allowed is None else allowed)
+    tasks = [(target, coalition, first) for target, coalition in coalitions.items() for first in first_candidates]
+    workers = workers or cpu_count()
+
+    shards = {}
+    if workers > 1:
+        pool = Pool(workers, initializer=init_search, initargs=(data, names, allowed, max_length, min_coalition))
+        done_tasks = pool.imap_unordered(search_shard, tasks)
+    else:
+        pool = None
+        init_search(data, names, allowed, max_length, min_coalition)
+        done_tasks = map(search_shard, tasks)
+    try:
+        for done, (target, first, manipulations, minimum) in enumerate(done_tasks, 1):
+            shards.setdefault(target, {})[first] = (manipulations, minimum)
+            if progress is not None:
+                progress(done, len(tasks), target)
+            if stop_at_first and len(manipulations) > 0:
+                break
+    finally:
+        if pool:
+            pool.terminate()                                    # Cancels whatever is still running
+            pool.join()
+
+    results = {}
+    for target, found in shards.items():
+        minimums = [minimum for _, minimum in found.values() if minimum is not None]
+        results[target] = ([m for first in sorted(found) for m in found[first][0]],
+                           min(minimums) if len(minimums) > 0 else None)
+    return results
+
+def STV(data, names, eliminations=None, rounds=None):
     """
     Single Transferable Vote
     input:
-        data: list of lists of ints (voters' votes)
+        data: WeightedProfile, OverlayProfile, BallotMatrix or list of lists of ints (voters' votes)
         names: dict of ints to strings (candidate names)
-        eliminations: list of ints (candidates to be eliminated)
+        eliminations: Eliminations or list of ints (candidates to be eliminated), left unchanged
+        rounds: list, if given the tallies of every round are appended to it
     """
-    winners, losers = plurality(data, names, eliminations)
-    eliminations += losers                                      # Add the eliminated candidates to the list of eliminations
-    if len(losers) == 0: 
-        return winners                                          # No more candidates to eliminate, final round
-    return STV(data, names, eliminations)                       # Run STV again without the eliminated candidates
+    eliminations = Eliminations(() if eliminations is None else eliminations)
+    tracer = tracing.TRACER                                     # None unless tracing is enabled
+    if tracer is not None:
+        start, scanned, round_nr = tracer.clock(), 0, 0
+    if isinstance(data, BallotMatrix):
+        count = data.stv_count(eliminations)
+    elif isinstance(data, OverlayProfile):
+        count = data.stv_count(len(names), eliminations)
+    else:
+        count = STVCount(*ballots_and_weights(data), len(names), eliminations)
+    while True:
+        nr_votes = count.tally()
+        winners, losers = plurality_result(nr_votes, names, eliminations)
+        if rounds is not None:
+            rounds.append({"nr_votes": nr_votes, "eliminated": losers})
+        eliminations += losers                                  # Add the eliminated candidates to the list of eliminations
+        transferred = count.eliminate(losers) if len(losers) > 0 else 0 # Only move the ballots of the eliminated candidates
+        if tracer is not None:
+            tracer.complete("stv.round", start, "a3", round=round_nr, ballots_scanned=count.scanned - scanned,
+                            ballots_transferred=transferred, eliminated=losers)
+            start, scanned, round_nr = tracer.clock(), count.scanned, round_nr + 1
+        if len(losers) == 0: 
+            return winners                                      # No more candidates to eliminate, final round
 
 
 if __name__ == "__main__":
@@ -162,24 +489,20 @@ if __name__ == "__main__":
     for i in alternatives:
         manipulators.append(find_manipulators(org_data, original_winner, i))
     
-    for candidate, manipulator in enumerate(manipulators):
-        if candidate == original_winner:
-            continue
-        ballot_combinations = itertools.permutations(alternatives, 6)
-        # for nr_manipulators in range()
-        for jdx, ballot_combination in enumerate(ballot_combinations):
-            if candidate not in ballot_combination or original_winner in ballot_combination:
-                continue
-            print(f"\rCandidate {candidate},Ballot {ballot_combination}", end="")
-            data = manipulate(org_data.copy(), ballot_combination, manipulator)
-            winner = STV(data, names)
-            # print(f"\rwinner: {winner}", end="    ")
-            if candidate in winner:
-                print(f"Manipulator: {manipulator}, Ballot: {ballot_combination}, Winner: {winner}")
-                end = t.time()
-                print(f"Time taken: {(end-start)}s")        
-                print("\n")
-                exit(0)
+    ballot_alternatives = [c for c in alternatives if c != original_winner]
+    coalitions = {candidate: manipulator for candidate, manipulator in enumerate(manipulators) if candidate != original_winner}
+    # Coalitions of hundreds of ballots are far too large to try every choice of voters
+    results = parallel_manipulation_search(org_data, names, coalitions, ballot_alternatives, 6,
+                                           progress=lambda done, total, _: print(f"{done}/{total} searches done"),
+                                           min_coalition="prefix")
+    for candidate, (manipulations, bound) in sorted(results.items()):
+        ballots = [b for m in manipulations for b in m.ballots(ballot_alternatives, 6) if candidate in b]
+        needed = "no part of the coalition in order succeeds" if bound is None else f"at most {bound} manipulators needed"
+        print(f"Candidate {candidate}: {len(ballots)} ballots, {needed} (taking the coalition's voters in order)")
+        for manipulation in manipulations:
+            print(f"\tCounting for {manipulation.ballot}")
+    end = t.time()
+    print(f"Time taken: {(end-start)}s")
 
 
 
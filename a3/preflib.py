@@ -0,0 +1,106 @@
+import bz2
+import gzip
+import itertools
+import re
+
+DATA_TYPES = ["soc", "soi", "toc", "toi"]
+
+# A token of an order is either a {...} tie group or a single candidate
+TOKEN = re.compile(r"\{([^}]*)\}|([^,{}\s]+)")
+
+
+def open_text(filename):
+    """
+    Open a (possibly gzip or bz2 compressed) file as text
+    input:
+        filename: string (path to the file)
+    output:
+        f: text file object
+    """
+    with open(filename, 'rb') as f:
+        magic = f.read(3)
+    if magic[:2] == b"\x1f\x8b":
+        return gzip.open(filename, 'rt')
+    if magic == b"BZh":
+        return bz2.open(filename, 'rt')
+    return open(filename, 'r')
+
+
+def parse_order(text):
+    """
+    Parse the preference order of a single PrefLib line
+    input:
+        text: string (e.g. "3,{1,10},2")
+    output:
+        ballot: list of ints, tie groups as lists of ints (0-indexed candidates)
+    """
+    ballot = []
+    for group, candidate in TOKEN.findall(text):
+        if candidate:
+            ballot.append(int(candidate) - 1)
+            continue
+        tied = [int(c) - 1 for c in group.split(",") if c.strip() != ""]
+        if len(tied) == 1:
+            ballot.append(tied[0])
+        elif len(tied) > 1:
+            ballot.append(tied)
+    return ballot
+
+
+class PreflibFile:
+    """
+    Streaming reader for PrefLib .soc/.soi/.toc/.toi files.
+    The header is read on construction, the ballots are read lazily while
+    iterating, so only one line of the file is held in memory at a time.
+    Iterating yields (ballot, nr_voters) tuples.
+    """
+    def __init__(self, filename) -> None:
+        self.filename = filename
+        self.metadata = {}
+        self.names = {}
+        self.f = open_text(filename)
+        self.first_line = None
+
+        for line in self.f:
+            if not line.startswith("#"):
+                self.first_line = line
+                break
+            key, _, value = line[1:].partition(":")
+            key = key.strip()
+            value = value.strip()
+            if key.startswith("ALTERNATIVE NAME"):
+                self.names[int(key.split(" ")[-1]) - 1] = value
+            else:
+                self.metadata[key] = value
+
+        self.data_type = self.metadata.get("DATA TYPE", "").lower()
+        if self.data_type not in DATA_TYPES:
+            extension = filename.split(".")[-1]
+            if extension in ["gz", "bz2"]:
+                extension = filename.split(".")[-2]
+            self.data_type = extension.lower()
+
+    def __iter__(self):
+        allow_ties = self.data_type in ["toc", "toi"]
+        lines = self.f
+        if self.first_line is not None:
+            lines = itertools.chain([self.first_line], self.f)
+            self.first_line = None
+
+        for line in lines:
+            if line.startswith("#") or line.strip() == "":
+                continue
+            count, _, order = line.partition(":")
+            ballot = parse_order(order)
+            if not allow_ties and any(type(c) == list for c in ballot):
+                raise ValueError(f"Tied preferences in a .{self.data_type} file: {line.strip()}")
+            yield ballot, int(count)
+
+    def close(self):
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
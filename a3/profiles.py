@@ -0,0 +1,222 @@
+from preflib import PreflibFile
+import common_path
+from stv import STVCount, first_choice, add_share, exact_votes
+from eliminations import Eliminations, as_eliminations
+
+
+class WeightedProfile:
+    """
+    Preference profile that stores every distinct ballot only once,
+    together with the number of voters that cast it
+    """
+    def __init__(self, ballots=None, weights=None) -> None:
+        self.ballots = [] if ballots is None else list(ballots)
+        self.weights = [] if weights is None else list(weights)
+        self.index = {ballot_key(ballot): idx for idx, ballot in enumerate(self.ballots)}
+
+    def add(self, ballot, weight=1):
+        """
+        Add weight voters casting ballot, merging it with an identical ballot if present
+        input:
+            ballot: list of ints or lists of ints (a single vote, tie groups as lists)
+            weight: int (number of voters casting this ballot)
+        output:
+            idx: int (position of the ballot in the profile)
+        """
+        key = ballot_key(ballot)
+        idx = self.index.get(key)
+        if idx is None:
+            idx = len(self.ballots)
+            self.index[key] = idx
+            self.ballots.append(ballot)
+            self.weights.append(weight)
+        else:
+            self.weights[idx] += weight
+        return idx
+
+    def nr_voters(self):
+        return sum(self.weights)
+
+    def copy(self):
+        profile = WeightedProfile()
+        profile.ballots = self.ballots.copy()
+        profile.weights = self.weights.copy()
+        profile.index = self.index.copy()
+        return profile
+
+    def expand(self):
+        """
+        Return the profile as a plain list holding one ballot per voter
+        """
+        data = []
+        for ballot, weight in zip(self.ballots, self.weights):
+            data += [ballot] * weight
+        return data
+
+    def __len__(self):
+        return len(self.ballots)
+
+    def __getitem__(self, idx):
+        return self.ballots[idx]
+
+    def __setitem__(self, idx, ballot):
+        # Every voter behind this entry switches to the new ballot
+        old_key = ballot_key(self.ballots[idx])
+        if self.index.get(old_key) == idx:
+            del self.index[old_key]
+        self.ballots[idx] = ballot
+        self.index.setdefault(ballot_key(ballot), idx)
+
+
+class OverlayProfile:
+    """
+    View of a WeightedProfile with some voters removed and some ballots added,
+    without copying the profile. Every overlay of the same base shares the tallies
+    of the whole base, so removing voters only takes their own votes off those.
+    Overlays made from the same one with with_ballot also share the removed voters
+    and the cache of their tallies, so every trial only counts its own added
+    ballots on top of tallies computed once.
+    """
+    def __init__(self, base, removed=None, added=(), tallies=None, base_tallies=None) -> None:
+        self.base = base
+        self.removed = {} if removed is None else removed       # Ballot index -> number of voters removed
+        self.added = list(added)                                # (ballot, weight) pairs
+        self.tallies = {} if tallies is None else tallies       # Elimination mask -> exact votes of base minus removed
+        self.base_tallies = {} if base_tallies is None else base_tallies # Elimination mask -> STVCount of base
+
+    def without(self, manipulators, size=None):
+        """
+        Overlay without the voters behind the given ballots of the base
+        input:
+            manipulators: list of ints (indexes of ballots in base), or dict of
+                          indexes to the number of voters to remove from each
+            size: int (remove only the first size voters), default all of them
+        """
+        if isinstance(manipulators, dict):
+            counts = manipulators.items()
+        else:
+            counts = ((idx, self.base.weights[idx]) for idx in manipulators)
+        removed = {}
+        left = self.base.nr_voters() if size is None else size
+        for idx, count in counts:
+            take = min(left, count, self.base.weights[idx] - removed.get(idx, 0))
+            if take <= 0:
+                continue
+            removed[idx] = removed.get(idx, 0) + take
+            left -= take
+        return OverlayProfile(self.base, removed, base_tallies=self.base_tallies)
+
+    def with_ballot(self, ballot, weight):
+        """
+        Same overlay plus weight voters casting ballot (a coalition ballot)
+        """
+        return OverlayProfile(self.base, self.removed, self.added + [(ballot, weight)], self.tallies, self.base_tallies)
+
+    def replace(self, replacements):
+        """
+        Overlay where every voter behind base ballot idx casts replacements[idx] instead
+        """
+        overlay = self.without(list(replacements))
+        overlay.added = [(ballot, self.base.weights[idx]) for idx, ballot in replacements.items()]
+        return overlay
+
+    def nr_removed(self):
+        return sum(self.removed.values())
+
+    def nr_voters(self):
+        return self.base.nr_voters() - self.nr_removed() + sum(weight for _, weight in self.added)
+
+    def first_preferences(self, eliminations, nr_candidates):
+        """
+        Exact first preference votes of the remaining candidates
+        output:
+            nr_votes: list of ints and Fractions
+        """
+        eliminations = as_eliminations(eliminations)
+        key = eliminations.mask
+        if key not in self.tallies:
+            if key not in self.base_tallies:
+                self.base_tallies[key] = STVCount(self.base.ballots, self.base.weights, nr_candidates, eliminations)
+            count = self.base_tallies[key]
+            nr_votes = list(count.nr_votes)
+            for idx, weight in self.removed.items():
+                add_share(nr_votes, count.share[idx], -weight)  # The base count knows what each ballot counts for
+            self.tallies[key] = nr_votes
+        nr_votes = list(self.tallies[key])
+        for ballot, weight in self.added:
+            add_share(nr_votes, first_choice(ballot, eliminations)[1], weight)
+        return nr_votes
+
+    def stv_count(self, nr_candidates, eliminations=()):
+        return OverlayCount(self, nr_candidates, eliminations)
+
+    def __iter__(self):
+        for idx, (ballot, weight) in enumerate(zip(self.base.ballots, self.base.weights)):
+            weight -= self.removed.get(idx, 0)
+            if weight > 0:
+                yield ballot, weight
+        yield from self.added
+
+
+class OverlayCount:
+    """
+    Same interface as STVCount, every tally reuses the overlay's cached tallies
+    """
+    def __init__(self, overlay, nr_candidates, eliminations=()) -> None:
+        self.overlay = overlay
+        self.nr_candidates = nr_candidates
+        self.eliminated = Eliminations(eliminations)
+        self.scanned = 0                                        # Added ballots counted so far, for tracing
+
+    def tally(self):
+        self.scanned += len(self.overlay.added)
+        return exact_votes(self.overlay.first_preferences(self.eliminated, self.nr_candidates))
+
+    def eliminate(self, losers):
+        """
+        Eliminate candidates
+        output:
+            transferred: int (number of added ballots that counted for a loser)
+        """
+        moving = sum(1 for ballot, _ in self.overlay.added
+                     if any(c in losers for c in first_choice(ballot, self.eliminated)[1]))
+        self.eliminated.extend(losers)
+        return moving
+
+
+def ballot_key(ballot):
+    """
+    Hashable version of a ballot, tie groups become tuples
+    """
+    return tuple(tuple(c) if type(c) == list else c for c in ballot)
+
+
+def weighted_ballots(data):
+    """
+    Iterate over (ballot, weight) pairs
+    input:
+        data: WeightedProfile, OverlayProfile, PreflibFile (streamed, single pass)
+              or list of lists of ints (one ballot per voter)
+    output:
+        iterator of (ballot, weight) tuples
+    """
+    if isinstance(data, WeightedProfile):
+        return zip(data.ballots, data.weights)
+    if isinstance(data, (OverlayProfile, PreflibFile)):
+        return iter(data)
+    return ((ballot, 1) for ballot in data)
+
+
+def ballots_and_weights(data):
+    """
+    Split data into a list of ballots and a list of weights
+    input:
+        data: anything accepted by weighted_ballots
+    output:
+        ballots: list of ballots
+        weights: list of ints (number of voters casting each ballot)
+    """
+    if isinstance(data, WeightedProfile):
+        return data.ballots, data.weights
+    pairs = list(weighted_ballots(data))
+    return [ballot for ballot, _ in pairs], [weight for _, weight in pairs]
@@ -1,63 +1,33 @@
 from os import path, sep, listdir
-import re
 import itertools
 import time as t 
+from fractions import Fraction
+from math import lcm
 import enum
+import numpy as np
+from profiles import WeightedProfile, OverlayProfile, weighted_ballots, ballots_and_weights
+import common_path
+from stv import STVCount, exact_votes
+from eliminations import Eliminations, as_eliminations
+import tracing
+from constraints import Constraint, ConstraintPath, feasible, minimal_manipulators
+from ballot_matrix import BallotMatrix
+from election_cache import load_cached
 
 cwd = path.dirname(path.abspath(__file__))
 
 DEBUGGING = False
-class Constraint:
-    def __init__(self, add, subtract, difference) -> None:
-        self.add = add
-        self.subtract = subtract
-        self.difference = difference
-    
-    def check_constraint(self):
-        return sum(self.add) - sum(self.subtract) + self.difference <= 0
-
-    
-    def string(self) -> str:
-        add = [chr(ord('a') + a) for a in self.add]
-        subtract = [chr(ord('a') + a) for a in self.subtract]
-        return f"{add} - {subtract} <= {-self.difference}"
-
-
-def load_data(filename="00016-00000001.toi"):
+PRUNE_CANDIDATES = 6                                            # Smaller branches are cheaper to expand than to check
+def load_data(filename="00016-00000001.toi", cache=True):
     """
-    Load data from file
+    Load data from a (possibly compressed) PrefLib .soc/.soi/.toc/.toi file.
+    The parsed election is stored in a binary sidecar next to the file,
+    later loads read that instead of parsing the text again
+    output:
+        data: WeightedProfile (distinct ballots and the number of voters casting them)
+        names: dict of ints to strings (candidate names)
     """
-    data = []
-    names = {}
-    with open(cwd + sep + filename, 'r') as f:
-        lines = f.readlines()
-        for line in lines:
-            if line.startswith("# ALTERNATIVE"):
-                s = line.split(":")
-                number = int(s[0].split(" ")[-1]) - 1
-                name = s[1].strip()
-                names[number] = name
-            
-            if line.startswith("#"):
-                continue
-            s = line.split(":")
-            nr_voters = int(s[0])
-            votes = []
-            if "{" in s[1]:
-                # Split {...} from the rest
-                new = re.split(r"(\{.*?\})", s[1].strip())
-                new[1] = new[1][1:-1]
-                votes = [int(v) - 1 for v in new[0].split(",") if v != ""]
-                votes += [[int(v) - 1 for v in new[1].split(",") if v != "" if v != "{" if v != "}"]]
-                votes += [int(v) - 1 for v in new[2].split(",") if v != ""]
-
-            else:
-                votes = [int(v) - 1 for v in s[1].strip().split(",")]    
-
-            for _ in range(nr_voters):
-                data.append(votes)
-    
-    return data, names
+    return load_cached(cwd + sep + filename, cache)
 
 
 def tied_vote(vote, eliminations):
@@ -65,50 +35,48 @@ def tied_vote(vote, eliminations):
     Resolve a tied vote
     input:
         vote: list of ints (candidates)
-        eliminations: list of ints (candidates that have been eliminated)
+        eliminations: Eliminations or list of ints (candidates that have been eliminated)
     output:
         vote: list of ints (candidates)"""
 
-    # print(vote)
-    if len(vote) == 1:
-        return None if vote[0] in eliminations else [vote[0]]
-    if vote[0] in eliminations and vote[1] in eliminations:
-        return None
-    if vote[0] in eliminations:
-        return [vote[1]]
-    if vote[1] in eliminations:
-        return [vote[0]]
-    return vote
+    remaining = [c for c in vote if c not in eliminations]      # Tie groups can hold any number of candidates
+    return remaining if len(remaining) > 0 else None
 
 def vote_count(data, names, eliminations):
     """
     Count the plurality score of each candidate
     input:
-        data: list of lists of ints (voters' votes)
+        data: WeightedProfile, OverlayProfile, BallotMatrix or list of lists of ints (voters' votes)
         names: dict of ints to strings (candidate names)
-        eliminations: list of ints (candidates that have been eliminated)
+        eliminations: Eliminations or list of ints (candidates that have been eliminated)
     output:
         nr_votes: list of ints (number of votes for each candidate)
     """
+    eliminations = as_eliminations(eliminations)                # O(1) membership for every ballot
+    if isinstance(data, BallotMatrix):
+        return data.first_preferences(eliminations)
+    if isinstance(data, OverlayProfile):
+        return exact_votes(data.first_preferences(eliminations, len(names)))
+
     nr_votes = [0] * len(names)
-    for ballot in data:                                         # For each ballot
+    for ballot, weight in weighted_ballots(data):               # For each ballot
         for candidate in ballot:                                # For first eligible candidate in the vote
             if type(candidate) == list:                         # In case of Split vote
                 result = tied_vote(candidate, eliminations)
                 if result is None:                              # Both candidates were eliminated,
                     continue                                    # continue to next candidate in ballot
                 for c in result:
-                    nr_votes[c] += 1/len(result)                # Add weighted vote to one or both candidates
-                    break
-                continue                                        # Both candidates were eliminated, continue to next candidate
+                    nr_votes[c] += Fraction(weight, len(result)) # Split the vote over the remaining tied candidates
+                break
             if candidate not in eliminations:
-                nr_votes[candidate] += 1                        # Add vote to single candidate
+                nr_votes[candidate] += weight                   # Add vote to single candidate
                 break
 
-    return nr_votes
+    return exact_votes(nr_votes)
 
 def plurality_loser(nr_votes, eliminations):
-    sorted_votes, sorted_candidates = zip(*sorted(zip(nr_votes, names.keys()), reverse=False))
+    eliminations = as_eliminations(eliminations)
+    sorted_votes, sorted_candidates = zip(*sorted(zip(nr_votes, range(len(nr_votes))), reverse=False))
     low_vote = sorted_votes[-1]
     losers = []
     for vote, candidate in zip(sorted_votes, sorted_candidates):
@@ -122,103 +90,178 @@ def plurality_loser(nr_votes, eliminations):
     
     return losers
 
-def STV(data, names, eliminations=[]):
+def STV(data, names, eliminations=None, rounds=None):
     """
     Single Transferable Vote
     input:
-        data: list of lists of ints (voters' votes)
+        data: WeightedProfile, OverlayProfile, BallotMatrix or list of lists of ints (voters' votes)
         names: dict of ints to strings (candidate names)
-        eliminations: list of ints (candidates to be eliminated)
+        eliminations: Eliminations or list of ints (candidates to be eliminated), left unchanged
+        rounds: list, if given the tallies of every round are appended to it
     """
-    nr_votes = vote_count(data, names, eliminations)
-    losers = plurality_loser(nr_votes, eliminations)
-
-    if len(losers) + len(eliminations) == len(names): 
-        return [c for c in range(len(names)) if c not in eliminations] # No more candidates to eliminate, final round
-    eliminations += losers                                      # Add the eliminated candidates to the list of eliminations
-    return STV(data, names, eliminations)                       # Run STV again without the eliminated candidates
-
-
-SCENARIOS = 0
-
-def STV_tree(data, names, eliminations=[], ballot=[], old_constraints=[], old_winners=[]):
-    print(f"Eliminations: {eliminations}, New ballot: {ballot}")
-    nr_votes = vote_count(data, names, eliminations)
-    losers = plurality_loser(nr_votes, eliminations)
-    global SCENARIOS
-
-    if len(losers) + len(eliminations) == len(names):
-        SCENARIOS += 1
-        return ([c for c in range(len(names)) if c not in eliminations][0], old_constraints, eliminations, ballot) # No more candidates to eliminate, final round
-
-    possible_alternatives = names.keys()
-    for candidate in ballot:
-        if candidate not in eliminations:
-            possible_alternatives = [candidate]
-
+    eliminations = Eliminations(() if eliminations is None else eliminations)
+    tracer = tracing.TRACER                                     # None unless tracing is enabled
+    if tracer is not None:
+        start, scanned, round_nr = tracer.clock(), 0, 0
+    if isinstance(data, BallotMatrix):
+        count = data.stv_count(eliminations)
+    elif isinstance(data, OverlayProfile):
+        count = data.stv_count(len(names), eliminations)
+    else:
+        count = STVCount(*ballots_and_weights(data), len(names), eliminations)
+    while True:
+        nr_votes = count.tally()
+        losers = plurality_loser(nr_votes, eliminations)
+        if rounds is not None:
+            rounds.append({"nr_votes": nr_votes, "eliminated": losers})
+
+        final = len(losers) + len(eliminations) == len(names)
+        if not final:
+            eliminations += losers                              # Add the eliminated candidates to the list of eliminations
+        transferred = 0 if final else count.eliminate(losers)   # Only move the ballots of the eliminated candidates
+        if tracer is not None:
+            tracer.complete("stv.round", start, "a3", round=round_nr, ballots_scanned=count.scanned - scanned,
+                            ballots_transferred=transferred, eliminated=[] if final else losers)
+            start, scanned, round_nr = tracer.clock(), count.scanned, round_nr + 1
+        if final:
+            return [c for c in range(len(names)) if c not in eliminations] # No more candidates to eliminate, final round
+
+
+def STV_tree(data, names, eliminations=None, ballot=None, old_winners=(), prune=True):
+    """
+    Explore every elimination order a group of manipulators could bring about, together
+    with the constraints on their numbers each order needs. The manipulators are voters
+    of the profile who cast the tree's ballot instead of their own, x[t] of them cast
+    the t-th ballot of the profile (see Constraint), at most as many as cast it. The
+    ballot never runs out: that eliminates the same candidates as voting for the winner.
+    The tree is walked with an explicit stack. Children of identical (eliminations, ballot)
+    states are only worked out once, from one STVCount that eliminates candidates on the
+    way down and restores them on the way back, so a new state only moves the piles
+    between it and the previous one. A branch that still has at least PRUNE_CANDIDATES
+    candidates left is dropped when the constraints along it cannot hold together (for
+    x with real values). Expanding a smaller branch costs less than the check, so its
+    leaves are returned unchecked and may have no solution.
+    input:
+        data: WeightedProfile or list of lists of ints (voters' votes)
+        names: dict of ints to strings (candidate names)
+        eliminations: Eliminations or list of ints (candidates already eliminated)
+        ballot: list of ints (start of the manipulators' ballot)
+        old_winners: list of ints (winner(s) without manipulation)
+        prune: bool, drop large branches whose constraints are infeasible
+    output:
+        results: list of (winner, constraints, eliminations, ballot) tuples, one per leaf,
+                 constraints is a ConstraintPath
+    """
+    eliminations = Eliminations(() if eliminations is None else eliminations)
+    ballot = [] if ballot is None else list(ballot)
+    ballots, weights = ballots_and_weights(data)
+    count = STVCount(ballots, weights, len(names), eliminations)
+    max_tie = max((len(e) for b in ballots for e in b if type(e) == list), default=1)
+    scale = lcm(*range(1, max_tie + 1))                         # Every split vote is a whole number of 1/scale
+    applied = []                                                # (candidate, undo) eliminated in count after the root
+    root = len(eliminations)
+    children = {}
     results = []
-    for new_alternative in possible_alternatives:
-        contradiction = False
-        new_ballot = ballot.copy()
-        if len(possible_alternatives) > 1:
-            new_ballot += [new_alternative]
-        if new_alternative in old_winners or new_alternative in eliminations:
+    stack = [(eliminations, ballot, ConstraintPath())]
+    while len(stack) > 0:
+        eliminations, ballot, constraints = stack.pop()
+        key = (eliminations.mask, tuple(ballot))
+        if key not in children:
+            # Move count from the last state it was used for to this one through their common ancestor
+            path = eliminations[root:]
+            common = 0
+            while common < min(len(applied), len(path)) and applied[common][0] == path[common]:
+                common += 1
+            while len(applied) > common:
+                elim, undo = applied.pop()
+                count.restore([elim], undo)
+            for elim in path[common:]:
+                undo = []
+                count.eliminate([elim], undo)                   # Only the loser's pile moves
+                applied.append((elim, undo))
+            children[key] = tree_children(count, names, eliminations, ballot, old_winners, scale)
+        if type(children[key]) == int:
+            results.append((children[key], constraints, eliminations, ballot))
             continue
 
-        for elim in names.keys():
-            if elim in eliminations:
+        check = prune and len(names) - len(eliminations) - 1 >= PRUNE_CANDIDATES
+        for elim, new_ballot, new_constraints in reversed(children[key]):
+            path_constraints = constraints.extend(new_constraints)  # Shares the path so far with its siblings
+            if check and not feasible(path_constraints, weights):
                 continue
+            stack.append((eliminations + [elim], new_ballot, path_constraints))   # A new Eliminations, siblings share the parent's
+    return results
+
+
+def tree_children(count, names, eliminations, ballot, old_winners, scale=1):
+    """
+    Children of a state of STV_tree. Here a manipulator of type t would have counted for
+    count.share[t] and counts for the ballot's current choice instead, so the votes of
+    every candidate are linear in x. A child eliminates one candidate, which needs
+    strictly fewer votes than every other remaining candidate (a tie would eliminate
+    them together).
+    input:
+        count: STVCount (sincere count of the whole profile in this state)
+        scale: int (every share of a vote is a whole number of 1/scale)
+    output:
+        winner: int if the count is over, otherwise
+        children: list of (eliminated candidate, new ballot, list of Constraint) tuples
+    """
+    remaining = [c for c in range(len(names)) if c not in eliminations]
+    if len(remaining) == 1:
+        return remaining[0]                                     # No more candidates to eliminate, final round
+
+    current = next((c for c in ballot if c not in eliminations), None)
+    if current is not None:
+        possible_alternatives = [current]
+    else:
+        possible_alternatives = [c for c in remaining if c not in old_winners]
+
+    shares = np.zeros((len(count.share), len(names)), dtype=np.int64) # Part of a voter of each type counting for each candidate, times scale
+    for voter_type, share in enumerate(count.share):
+        for c in share:
+            shares[voter_type, c] = scale // len(share)
+    nr_votes = [int(v * scale) for v in count.nr_votes]
+
+    children = []
+    for new_alternative in possible_alternatives:
+        new_ballot = ballot if new_alternative == current else ballot + [new_alternative]
+        for elim in remaining:
+            contradiction = False
             constraints = []
-            for other_candidate in names.keys():
-                if other_candidate in eliminations or other_candidate in old_winners:
+            for other_candidate in remaining:
+                if other_candidate == elim:
                     continue
-
-                difference = nr_votes[elim] - nr_votes[other_candidate]
-                add = [other_candidate]
-                subtract = [elim]
-                if elim in old_winners:
-                    subtract = []
-                if new_alternative == elim:
-                    subtract = []
-                    add += [i for i in names.keys() if i not in old_winners and i not in eliminations and i != new_alternative]
-                    if difference <= 0:
-                        contradiction = True
-                        break
-                if new_alternative == other_candidate:
-                    add = []
-                    subtract += [i for i in names.keys() if i not in old_winners and i != new_alternative and i != elim]
-                    if difference >= 0:
-                        continue
-                
-                if add == subtract:
+                # scale * (votes of elim - votes of other_candidate) <= -1, every manipulator takes
+                # its own share away and adds a whole vote to new_alternative
+                coefficients = shares[:, other_candidate] - shares[:, elim]
+                coefficients += scale * (int(elim == new_alternative) - int(other_candidate == new_alternative))
+                difference = nr_votes[elim] - nr_votes[other_candidate] + 1
+                if not coefficients.any():
                     if difference > 0:
                         contradiction = True
                         break
                     continue
+                constraints.append(Constraint.from_coefficients(coefficients, difference))
 
-                constraints.append(Constraint(add, subtract, difference))
-            
             if contradiction:
                 continue
-
-            new_eliminations = eliminations + [elim]
-            result = STV_tree(data, names, new_eliminations, new_ballot, old_constraints + constraints, old_winners)
-            results.append(result)
-    
-    return results
+            children.append((elim, new_ballot, constraints))
+    return children
 
 
 def eliminate(data, eliminations):
     """
     Eliminate candidates from the data
     input:
-        data: list of lists of ints (voters' votes)
-        eliminations: list of ints (candidates to be eliminated)
+        data: WeightedProfile or list of lists of ints (voters' votes)
+        eliminations: Eliminations or list of ints (candidates to be eliminated)
     output:
-        new_data: list of lists of ints (voters' votes)
+        new_data: WeightedProfile (voters' votes)
     """
-    new_data = []
-    for ballot in data:
+    eliminations = as_eliminations(eliminations)
+    new_data = WeightedProfile()
+    for ballot, weight in weighted_ballots(data):
         new_ballot = []
         for candidate in ballot:
             if type(candidate) == list:
@@ -229,22 +272,42 @@ def eliminate(data, eliminations):
             elif candidate not in eliminations:
                 new_ballot.append(candidate)
 
-        new_data.append(new_ballot)
+        new_data.add(new_ballot, weight)
     return new_data
 
 
-def print_constraints(results, exclude=None):
+def ballot_label(ballot):
+    """
+    Short name of a ballot, a tie group in brackets: "b[cd]a"
+    """
+    return "".join(chr(ord('a') + c) if type(c) != list else "[" + "".join(chr(ord('a') + d) for d in c) + "]"
+                   for c in ballot)
+
+
+def print_constraints(results, exclude=None, labels=None, upper=None):
+    """
+    labels: list of strings (name of every ballot type), to also solve for the minimal manipulators
+            and leave out the leaves no number of manipulators reaches
+    upper: list of ints (number of voters casting each ballot type)
+    """
     for result in results:
         if type(result) == list:
-            print_constraints(result)
+            print_constraints(result, exclude, labels, upper)
         elif result[0] != 3:
             continue
         else:
+            if labels is not None:
+                manipulators = minimal_manipulators(*ConstraintPath(None, result[1]).system(len(labels)), upper)
+                if manipulators is None:
+                    continue                                    # Small branches are not pruned, see STV_tree
             print(result[0])
             for constraint in result[1]:
-                print(constraint.string())
+                print(constraint.string(labels))
             print(f"Elimination order: {[chr(x + ord('a')) for x in result[2]]}")
             print(f"Ballot: {[chr(x + ord('a')) for x in result[3]]}")
+            if labels is not None:
+                manipulators = {labels[voter_type]: n for voter_type, n in enumerate(manipulators) if n > 0}
+                print(f"Minimal manipulators: {manipulators}")
             print()
 
 if __name__ == "__main__":
@@ -255,5 +318,6 @@ if __name__ == "__main__":
     print(f"Original winner: {original_winner}")
 
     results = STV_tree(org_data, names, eliminations=[], ballot=[], old_winners=original_winner)
-    print_constraints(results, exclude=original_winner)
-    print(SCENARIOS)
+    ballots, weights = ballots_and_weights(org_data)
+    print_constraints(results, exclude=original_winner, labels=[ballot_label(b) for b in ballots], upper=weights)
+    print(len(results))
@@ -0,0 +1,149 @@
+from math import lcm
+import numpy as np
+
+
+class BallotMatrix:
+    """
+    Profile packed into padded int matrices for vectorised counting.
+    ranks[i, j] is the j-th candidate listed on ballot i (-1 is padding) and
+    levels[i, j] the position of its entry in the ballot, so the candidates
+    of a tie group share a level. weights[i] is the number of voters casting
+    ballot i.
+    Split votes are counted in units of 1/scale (scale is divisible by every
+    tie group size), which keeps every tally an exact integer internally.
+    """
+    def __init__(self, ranks, levels, weights, nr_candidates, max_tie=1) -> None:
+        self.ranks = np.asarray(ranks, dtype=np.int32)
+        self.levels = np.asarray(levels, dtype=np.int32)
+        self.weights = np.asarray(weights, dtype=np.int64)
+        self.nr_candidates = nr_candidates
+        self.scale = lcm(*range(1, max_tie + 1))
+        self.rows = np.arange(len(self.weights))
+
+    @classmethod
+    def from_ballots(cls, ballots, weights, nr_candidates):
+        """
+        Pack a list of ballots
+        input:
+            ballots: list of lists of ints, tie groups as lists of ints
+            weights: list of ints (number of voters casting each ballot), None for one each
+            nr_candidates: int
+        output:
+            matrix: BallotMatrix
+        """
+        if weights is None:
+            weights = [1] * len(ballots)
+        width = max([sum(len(e) if type(e) == list else 1 for e in ballot) for ballot in ballots], default=0)
+        ranks = np.full((len(ballots), width), -1, dtype=np.int32)
+        levels = np.full((len(ballots), width), -1, dtype=np.int32)
+        max_tie = 1
+        for i, ballot in enumerate(ballots):
+            j = 0
+            for level, entry in enumerate(ballot):
+                group = entry if type(entry) == list else [entry]
+                max_tie = max(max_tie, len(group))
+                for c in group:
+                    ranks[i, j] = c
+                    levels[i, j] = level
+                    j += 1
+        return cls(ranks, levels, weights, nr_candidates, max_tie)
+
+    def __len__(self):
+        return len(self.weights)
+
+    def nr_voters(self):
+        return int(self.weights.sum())
+
+    def eliminated_mask(self, eliminations):
+        """
+        Boolean array over candidates, the extra last entry covers the -1 padding
+        """
+        mask = np.zeros(self.nr_candidates + 1, dtype=bool)
+        mask[list(eliminations)] = True
+        mask[-1] = True
+        return mask
+
+    def first_choices(self, eliminations):
+        """
+        Entries each ballot currently counts for
+        input:
+            eliminations: list or set of ints (candidates that have been eliminated)
+        output:
+            counted: bool matrix (remaining candidates of each ballot's first remaining entry)
+            share: int array (units of 1/scale each counted candidate receives per ballot)
+        """
+        valid = ~self.eliminated_mask(eliminations)[self.ranks]
+        if valid.shape[1] == 0:
+            return valid, self.weights * self.scale             # Only empty ballots, every one is exhausted
+        has_choice = valid.any(axis=1)
+        first = valid.argmax(axis=1)
+        first_level = np.where(has_choice, self.levels[self.rows, first], -2)
+        counted = valid & (self.levels == first_level[:, None])
+        group = np.maximum(counted.sum(axis=1), 1)
+        share = self.weights * self.scale // group
+        return counted, share
+
+    def to_votes(self, points):
+        """
+        Convert tallies in units of 1/scale back to vote counts, split votes as floats
+        """
+        return [p // self.scale if p % self.scale == 0 else p / self.scale for p in points.tolist()]
+
+    def first_preferences(self, eliminations):
+        """
+        Plurality score of each candidate, same as the pure-Python counting loops
+        """
+        return self.stv_count(eliminations).tally()
+
+    def count(self, entries, points):
+        """
+        Sum points per candidate over the selected entries
+        input:
+            entries: bool matrix (entries to count)
+            points: int matrix (points of each entry)
+        output:
+            totals: int array (total points per candidate)
+        """
+        totals = np.bincount(self.ranks[entries], weights=points[entries], minlength=self.nr_candidates)
+        return np.rint(totals).astype(np.int64)
+
+    def approval_scores(self):
+        listed = self.ranks >= 0
+        return self.count(listed, np.broadcast_to(self.weights[:, None], self.ranks.shape)).tolist()
+
+    def borda_scores(self):
+        listed = self.ranks >= 0
+        points = (self.nr_candidates - 1 - self.levels) * self.weights[:, None]
+        return self.count(listed, points).tolist()
+
+    def stv_count(self, eliminations=()):
+        return MatrixCount(self, eliminations)
+
+
+class MatrixCount:
+    """
+    Same interface as STVCount, every tally is one vectorised pass over the matrix
+    """
+    def __init__(self, matrix, eliminations=()) -> None:
+        self.matrix = matrix
+        self.eliminated = set(eliminations)
+        self.counted = None
+        self.scanned = 0                                        # Ballots looked at so far, for tracing
+
+    def tally(self):
+        self.scanned += len(self.matrix)
+        self.counted, share = self.matrix.first_choices(self.eliminated)
+        points = np.broadcast_to(share[:, None], self.matrix.ranks.shape)
+        return self.matrix.to_votes(self.matrix.count(self.counted, points))
+
+    def eliminate(self, losers):
+        """
+        Eliminate candidates
+        output:
+            transferred: int (number of ballots that counted for a loser)
+        """
+        if self.counted is None:
+            self.tally()
+        moving = (np.isin(self.matrix.ranks, list(losers)) & self.counted).any(axis=1)
+        self.eliminated.update(losers)
+        return int(moving.sum())
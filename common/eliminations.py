@@ -0,0 +1,85 @@
+from operator import index
+import numpy as np
+
+
+class Eliminations:
+    """
+    Candidates eliminated so far, in the order they were eliminated.
+    Membership is a bit test on an integer mask, so checking a candidate
+    costs the same however many are eliminated, and the mask is a hashable
+    key for memoizing anything that only depends on who is eliminated.
+    Plain lists and sets of candidates are accepted wherever this is.
+    """
+    __slots__ = ("order", "mask")
+
+    def __init__(self, candidates=()) -> None:
+        self.order = []
+        self.mask = 0
+        self.extend(candidates)
+
+    def add(self, candidate):
+        bit = 1 << candidate
+        if not self.mask & bit:
+            self.mask |= bit
+            self.order.append(candidate)
+
+    def extend(self, candidates):
+        for candidate in candidates:
+            self.add(index(candidate))
+
+    def __iadd__(self, candidates):
+        self.extend(candidates)
+        return self
+
+    def __add__(self, candidates):
+        eliminations = self.copy()
+        eliminations.extend(candidates)
+        return eliminations
+
+    def __contains__(self, candidate):
+        try:
+            candidate = index(candidate)
+        except TypeError:
+            return False                                        # Tie groups and other non-candidates
+        return candidate >= 0 and (self.mask >> candidate) & 1 == 1
+
+    def copy(self):
+        eliminations = Eliminations()
+        eliminations.order = self.order.copy()
+        eliminations.mask = self.mask
+        return eliminations
+
+    def remaining(self, nr_candidates):
+        return [c for c in range(nr_candidates) if not (self.mask >> c) & 1]
+
+    def as_array(self, nr_candidates):
+        """
+        Boolean array, True for the eliminated candidates
+        """
+        mask = np.zeros(nr_candidates, dtype=bool)
+        mask[self.order] = True
+        return mask
+
+    def __iter__(self):
+        return iter(self.order)
+
+    def __len__(self):
+        return len(self.order)
+
+    def __getitem__(self, idx):
+        return self.order[idx]
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __repr__(self) -> str:
+        return f"Eliminations({self.order})"
+
+
+def as_eliminations(eliminations):
+    """
+    Eliminations for any collection of candidates, None meaning nobody
+    """
+    if isinstance(eliminations, Eliminations):
+        return eliminations
+    return Eliminations(() if eliminations is None else eliminations)
@@ -0,0 +1,267 @@
+"""
+Synthetic preference profiles, generated in bulk straight into the arrays of a
+BallotMatrix. Every model returns a ranks matrix (one complete ranking per row,
+best first), truncate and add_ties turn rankings into .soi/.toi style ballots,
+and matrix packs them, merging identical ballots into weighted rows.
+stream yields a profile in chunks, for profiles that do not fit in memory.
+"""
+from math import factorial
+import numpy as np
+from ballot_matrix import BallotMatrix
+
+MODELS = ["ic", "iac", "mallows", "urn", "spatial"]
+
+
+def impartial_culture(nr_voters, nr_candidates, seed=None):
+    """
+    Every ranking equally likely, independently for every voter
+    output:
+        ranks: int matrix (one ranking per row)
+    """
+    rng = np.random.default_rng(seed)
+    ranks = np.broadcast_to(np.arange(nr_candidates, dtype=np.int32), (nr_voters, nr_candidates))
+    return rng.permuted(ranks, axis=1)
+
+
+def mallows(nr_voters, nr_candidates, phi, reference=None, seed=None):
+    """
+    Mallows model by repeated insertion: candidate i of the reference ranking goes to
+    position j of the i candidates before it with probability proportional to phi^(i - j).
+    phi = 1 is impartial culture, phi = 0 makes every voter cast the reference ranking.
+    Takes O(nr_candidates^2) per voter, every insertion is done for all voters at once.
+    input:
+        phi: float in [0, 1] (dispersion)
+        reference: list of ints (central ranking), defaults to 0, 1, 2, ...
+    output:
+        ranks: int matrix (one ranking per row)
+    """
+    rng = np.random.default_rng(seed)
+    ranks = np.zeros((nr_voters, min(nr_candidates, 1)), dtype=np.int32)
+    for i in range(1, nr_candidates):
+        p = float(phi) ** np.arange(i, -1, -1, dtype=float)
+        position = rng.choice(i + 1, size=nr_voters, p=p / p.sum())[:, None]
+        columns = np.arange(i + 1)
+        shifted = np.take_along_axis(ranks, np.minimum(columns - (columns > position), i - 1), axis=1)
+        ranks = np.where(columns == position, i, shifted).astype(np.int32)
+    if reference is None:
+        return ranks
+    return np.asarray(reference, dtype=np.int32)[ranks]
+
+
+def urn_chunks(nr_voters, nr_candidates, alpha, chunk_size, seed=None):
+    """
+    Polya-Eggenberger urn: after i voters the next one draws a fresh uniformly random
+    ranking with probability 1 / (1 + alpha * i), and otherwise copies the ranking of a
+    uniformly chosen earlier voter. alpha = 0 is impartial culture, alpha = 1 / m! is
+    impartial anonymous culture. Copies of voters of earlier chunks only need the
+    distinct rankings drawn so far and their weights, which are kept between chunks.
+    output:
+        iterator of (ranks, weights) pairs, the distinct rankings of a chunk's voters
+        and how many of them cast each
+    """
+    rng = np.random.default_rng(seed)
+    drawn = np.zeros((0, nr_candidates), dtype=np.int32)        # Distinct rankings of all chunks so far
+    totals = np.zeros(0, dtype=np.int64)                        # Voters casting each of them so far
+    for start in range(0, nr_voters, chunk_size):
+        voters = np.arange(start, min(start + chunk_size, nr_voters))
+        fresh = rng.random(len(voters)) * (1 + alpha * voters) < 1
+        copied = (rng.random(len(voters)) * voters).astype(np.int64)    # Earlier voter being copied
+        earlier = ~fresh & (copied < start)
+
+        # Copies within the chunk point at an earlier voter of the chunk, follow them to a fresh or earlier one
+        source = np.where(fresh | earlier, voters, copied) - start
+        while True:
+            followed = source[source]
+            if (followed == source).all():
+                break
+            source = followed
+
+        # A uniformly chosen voter of an earlier chunk casts a ranking in proportion to its weight
+        labels = np.empty(len(voters), dtype=np.int64)
+        labels[earlier] = np.searchsorted(np.cumsum(totals), copied[earlier], side="right")
+        labels[fresh] = len(drawn) + np.arange(int(fresh.sum()))
+        labels = labels[source]
+
+        drawn = np.concatenate([drawn, impartial_culture(int(fresh.sum()), nr_candidates, rng)])
+        counts = np.bincount(labels, minlength=len(drawn))
+        present = np.flatnonzero(counts)
+        yield drawn[present], counts[present]
+        if alpha > 0:
+            totals = np.concatenate([totals, np.zeros(len(drawn) - len(totals), dtype=np.int64)]) + counts
+        else:
+            drawn = drawn[:0]                                   # Nobody is ever copied, nothing to keep
+
+
+def spatial(nr_voters, nr_candidates, dimensions=4, groups=None, points=None, utility="distance", seed=None):
+    """
+    Voters and candidates are points in space, every voter ranks the candidates by
+    utility. This generalises the simulation's neighborhoods: groups are
+    (share, center, spread) triples and a group's voters are normally distributed
+    around its center, without groups voters are uniform in [-1, 1]^dimensions.
+    input:
+        groups: list of (float, list of floats, float) tuples, optional
+        points: float matrix (nr_candidates x dimensions), uniform in [-1, 1] if None
+        utility: "distance" (closest first) or "dot" (largest dot product first, as the simulation scores projects)
+    output:
+        ranks: int matrix (one ranking per row)
+    """
+    rng = np.random.default_rng(seed)
+    if points is None:
+        points = rng.uniform(-1, 1, size=(nr_candidates, dimensions))
+    points = np.asarray(points, dtype=float)
+    if groups is None:
+        voters = rng.uniform(-1, 1, size=(nr_voters, points.shape[1]))
+    else:
+        shares = np.array([share for share, _, _ in groups], dtype=float)
+        sizes = rng.multinomial(nr_voters, shares / shares.sum())
+        voters = np.concatenate([rng.normal(center, spread, size=(size, points.shape[1]))
+                                 for size, (_, center, spread) in zip(sizes, groups)])
+    if utility == "distance":
+        scores = -((voters[:, None, :] - points[None, :, :]) ** 2).sum(axis=2)
+    elif utility == "dot":
+        scores = voters @ points.T
+    else:
+        raise ValueError(f"Unknown utility {utility}")
+    return np.argsort(-scores, axis=1, kind="stable").astype(np.int32)
+
+
+def truncate(ranks, min_length=1, max_length=None, seed=None):
+    """
+    Cut every ranking off after a uniformly random length, the rest becomes -1 padding (.soi/.toi)
+    """
+    rng = np.random.default_rng(seed)
+    max_length = ranks.shape[1] if max_length is None else max_length
+    lengths = rng.integers(min_length, max_length + 1, size=len(ranks))
+    return np.where(np.arange(ranks.shape[1]) < lengths[:, None], ranks, -1).astype(np.int32)
+
+
+def add_ties(ranks, p_tie, max_tie=3, seed=None):
+    """
+    Levels of the entries of ranks when every listed candidate is tied with the one
+    before it with probability p_tie, in tie groups of at most max_tie candidates (.toc/.toi)
+    output:
+        levels: int matrix (position of every entry's group on its ballot, -1 for padding)
+    """
+    rng = np.random.default_rng(seed)
+    columns = np.arange(ranks.shape[1])
+    joined = (rng.random(ranks.shape) < p_tie) & (ranks >= 0)
+    joined[:, :1] = False
+    start = np.maximum.accumulate(np.where(joined, 0, columns), axis=1)  # First entry of every entry's group
+    joined &= (columns - start) % max_tie != 0                  # Split groups that grew too large
+    levels = np.cumsum(~joined, axis=1) - 1
+    return np.where(ranks >= 0, levels, -1).astype(np.int32)
+
+
+def matrix(ranks, nr_candidates, levels=None, weights=None, merge=True):
+    """
+    Pack generated ballots into a BallotMatrix
+    input:
+        levels: int matrix (see add_ties), every entry its own level if None
+        weights: int array (voters casting each row), one each if None
+        merge: bool, combine identical ballots into one weighted row
+    output:
+        matrix: BallotMatrix
+    """
+    ranks = np.asarray(ranks, dtype=np.int32)
+    if levels is None:
+        levels = np.where(ranks >= 0, np.arange(ranks.shape[1], dtype=np.int32), -1)
+    weights = np.ones(len(ranks), dtype=np.int64) if weights is None else np.asarray(weights, dtype=np.int64)
+    if merge and len(ranks) > 0:
+        rows, inverse = np.unique(np.concatenate([ranks, levels], axis=1), axis=0, return_inverse=True)
+        weights = np.bincount(inverse.ravel(), weights=weights, minlength=len(rows)).astype(np.int64)
+        ranks, levels = rows[:, :ranks.shape[1]], rows[:, ranks.shape[1]:]
+
+    listed = levels >= 0
+    rows = np.broadcast_to(np.arange(len(ranks))[:, None], ranks.shape)[listed]
+    groups = np.bincount(rows * (ranks.shape[1] + 1) + levels[listed]) if listed.any() else np.ones(1, dtype=np.int64)
+    return BallotMatrix(ranks, levels, weights, nr_candidates, max(int(groups.max()), 1))
+
+
+def draw(model, nr_voters, nr_candidates, rng, **params):
+    """
+    Rankings of one chunk of voters of a model other than the urns
+    """
+    if model == "ic":
+        return impartial_culture(nr_voters, nr_candidates, rng)
+    if model == "mallows":
+        return mallows(nr_voters, nr_candidates, params.get("phi", 0.5), params.get("reference"), rng)
+    if model == "spatial":
+        return spatial(nr_voters, nr_candidates, params.get("dimensions", 4), params.get("groups"), params.get("points"),
+                       params.get("utility", "distance"), rng)
+    raise ValueError(f"Unknown model {model}")
+
+
+def stream(model, nr_voters, nr_candidates, chunk_size=1 << 16, truncation=None, ties=None, merge=True, seed=None, **params):
+    """
+    A profile of nr_voters drawn from a model, in BallotMatrix chunks of at most chunk_size voters
+    input:
+        model: string, one of MODELS
+        truncation: (min_length, max_length) tuple, see truncate, complete rankings if None
+        ties: (p_tie, max_tie) tuple, see add_ties, no ties if None
+        merge: bool, identical ballots of a chunk become one weighted row
+        params: parameters of the model (phi and reference for mallows, alpha for urn,
+                dimensions, groups, points and utility for spatial)
+    output:
+        iterator of BallotMatrix
+    """
+    rng = np.random.default_rng(seed)
+    if model in ["iac", "urn"]:
+        alpha = 1 / factorial(nr_candidates) if model == "iac" else params.get("alpha", 0.1)
+        chunks = urn_chunks(nr_voters, nr_candidates, alpha, chunk_size, rng)
+    else:
+        if model == "spatial" and params.get("points") is None:  # Every chunk votes on the same candidates
+            params["points"] = rng.uniform(-1, 1, size=(nr_candidates, params.get("dimensions", 4)))
+        chunks = ((draw(model, min(chunk_size, nr_voters - start), nr_candidates, rng, **params), None)
+                  for start in range(0, nr_voters, chunk_size))
+
+    for ranks, weights in chunks:
+        if truncation is not None:
+            ranks = truncate(ranks, *truncation, seed=rng)
+        levels = add_ties(ranks, *ties, seed=rng) if ties is not None else None
+        yield matrix(ranks, nr_candidates, levels, weights, merge)
+
+
+def generate(model, nr_voters, nr_candidates, seed=None, **params):
+    """
+    A whole profile drawn from a model as one BallotMatrix, see stream for the parameters
+    """
+    return combine(stream(model, nr_voters, nr_candidates, seed=seed, **params), nr_candidates)
+
+
+def combine(matrices, nr_candidates, merge=True):
+    """
+    One BallotMatrix of several (e.g. the chunks of stream), identical ballots merged
+    into weighted rows, so a profile of few distinct ballots fits however many voters cast them
+    """
+    ranks, levels, weights, width = [], [], [], 0
+    for chunk in matrices:
+        ranks.append(chunk.ranks)
+        levels.append(chunk.levels)
+        weights.append(chunk.weights)
+        width = max(width, chunk.ranks.shape[1])
+    pad = lambda m: np.pad(m, ((0, 0), (0, width - m.shape[1])), constant_values=-1)
+    if len(ranks) == 0:
+        return matrix(np.zeros((0, 0), dtype=np.int32), nr_candidates)
+    return matrix(np.concatenate([pad(m) for m in ranks]), nr_candidates, np.concatenate([pad(m) for m in levels]),
+                  np.concatenate(weights), merge)
+
+
+def to_ballots(profile):
+    """
+    Ballots of a BallotMatrix as lists, tie groups as lists of ints
+    output:
+        ballots: list of lists, weights: list of ints (e.g. for a3's WeightedProfile)
+    """
+    ballots = []
+    for ranks, levels in zip(profile.ranks.tolist(), profile.levels.tolist()):
+        ballot, previous = [], -1
+        for c, level in zip(ranks, levels):
+            if level < 0:
+                break
+            if level == previous:
+                ballot[-1] = ballot[-1] + [c] if type(ballot[-1]) == list else [ballot[-1], c]
+            else:
+                ballot.append(c)
+            previous = level
+        ballots.append(ballot)
+    return ballots, profile.weights.tolist()
@@ -0,0 +1,129 @@
+import numpy as np
+from ballot_matrix import BallotMatrix
+
+UNLISTED = np.iinfo(np.int32).max
+
+
+def ballot_positions(ballot):
+    """
+    Position of every candidate listed on a ballot, tied candidates share a position
+    input:
+        ballot: list of ints, tie groups as lists of ints
+    output:
+        positions: dict of ints to ints (candidate to position)
+    """
+    positions = {}
+    for idx, entry in enumerate(ballot):
+        for c in (entry if type(entry) == list else [entry]):
+            positions[c] = idx
+    return positions
+
+
+def pairwise_matrix(data, nr_candidates):
+    """
+    Pairwise majority matrix of a profile, computed in one pass over the ballots.
+    A ballot prefers a over b if a is listed above b, or a is listed and b
+    is not. Candidates that are tied or both unlisted are not compared.
+    input:
+        data: list of lists of ints (voters' votes) or BallotMatrix
+        nr_candidates: int
+    output:
+        pairwise: list of lists of ints (pairwise[a][b] voters prefer a over b)
+    """
+    if isinstance(data, BallotMatrix):
+        return matrix_pairwise(data).tolist()
+
+    pairwise = [[0] * nr_candidates for _ in range(nr_candidates)]
+    for ballot in data:
+        positions = ballot_positions(ballot)
+        for a, position in positions.items():
+            row = pairwise[a]
+            for b in range(nr_candidates):
+                if positions.get(b, UNLISTED) > position:
+                    row[b] += 1
+    return pairwise
+
+
+def matrix_pairwise(matrix):
+    """
+    Vectorised pairwise majority matrix of a BallotMatrix
+    output:
+        pairwise: int matrix (pairwise[a, b] voters prefer a over b)
+    """
+    m = matrix.nr_candidates
+    positions = np.full((len(matrix), m + 1), UNLISTED, dtype=np.int32)
+    columns = np.where(matrix.ranks >= 0, matrix.ranks, m)     # Padding lands in the extra column
+    positions[matrix.rows[:, None], columns] = matrix.levels
+    positions = positions[:, :m]
+
+    pairwise = np.zeros((m, m), dtype=np.int64)
+    for a in range(m):
+        pairwise[a] = matrix.weights @ (positions[:, a:a + 1] < positions)
+    return pairwise
+
+
+def majority_graph(pairwise):
+    """
+    wins[a][b] is 1 if a majority prefers a over b
+    """
+    m = len(pairwise)
+    wins = [[0] * m for _ in range(m)]
+    for a in range(m):
+        for b in range(a + 1, m):
+            if pairwise[a][b] > pairwise[b][a]:
+                wins[a][b] = 1
+            elif pairwise[a][b] < pairwise[b][a]:
+                wins[b][a] = 1
+    return wins
+
+
+def margins(pairwise):
+    """
+    margins[a][b] = voters preferring a over b minus voters preferring b over a
+    """
+    pairwise = np.asarray(pairwise, dtype=np.int64)
+    return pairwise - pairwise.T
+
+
+def strongest_paths(pairwise):
+    """
+    Strength of the strongest path between every pair of candidates (Schulze),
+    a path is as strong as its weakest pairwise victory
+    """
+    pairwise = np.asarray(pairwise, dtype=np.int64)
+    paths = np.where(pairwise > pairwise.T, pairwise, 0)
+    np.fill_diagonal(paths, 0)
+    for k in range(len(paths)):
+        paths = np.maximum(paths, np.minimum(paths[:, k:k + 1], paths[k:k + 1, :]))
+    np.fill_diagonal(paths, 0)
+    return paths
+
+
+def ranked_pairs_graph(pairwise):
+    """
+    Lock pairwise victories from the largest margin down, skipping any that would create a cycle
+    output:
+        reach: list of sets (reach[a] holds every candidate a is locked above)
+    """
+    margin = margins(pairwise)
+    m = len(margin)
+    victories = sorted(((margin[a][b], -a, -b) for a in range(m) for b in range(m) if margin[a][b] > 0), reverse=True)
+    reach = [set() for _ in range(m)]
+    for _, a, b in victories:
+        a, b = -a, -b
+        if a in reach[b]:
+            continue                                            # b is already locked above a
+        above = [c for c in range(m) if a in reach[c]] + [a]
+        below = reach[b] | {b}
+        for c in above:
+            reach[c] |= below
+    return reach
+
+
+def kemeny_lower_bound(pairwise):
+    """
+    Lower bound on the Kemeny score (total pairwise disagreements) of any ranking,
+    every ranking disagrees with at least the minority of each pair
+    """
+    pairwise = np.asarray(pairwise, dtype=np.int64)
+    return int(np.minimum(pairwise, pairwise.T)[np.triu_indices(len(pairwise), 1)].sum())
@@ -0,0 +1,124 @@
+from fractions import Fraction
+
+
+def exact_votes(nr_votes):
+    """
+    Convert exactly counted votes (ints and Fractions) to ints, split votes as floats
+    """
+    return [float(v) if v.denominator != 1 else int(v) for v in nr_votes]
+
+
+def first_choice(ballot, eliminated, start=0):
+    """
+    First remaining choice on a ballot at or after position start
+    output:
+        level: int (position of the choice in the ballot)
+        share: list of ints (candidates the ballot counts for, empty if it is exhausted)
+    """
+    for level in range(start, len(ballot)):
+        entry = ballot[level]
+        if type(entry) == list:
+            share = [c for c in entry if c not in eliminated]
+        elif entry not in eliminated:
+            share = [entry]
+        else:
+            continue
+        if len(share) > 0:
+            return level, share
+    return len(ballot), []
+
+
+def add_share(nr_votes, share, weight):
+    """
+    Add weight votes split evenly over the candidates in share
+    """
+    if len(share) == 0:
+        return                                                  # Exhausted ballot
+    portion = weight if len(share) == 1 else Fraction(weight, len(share))
+    for c in share:
+        nr_votes[c] += portion
+
+
+class STVCount:
+    """
+    Incremental plurality tallies for STV.
+    Every ballot sits on the pile of the candidate(s) it currently counts
+    for. Eliminating candidates only moves the ballots on their piles to the
+    next remaining choice, instead of recounting every ballot each round.
+    A tie group splits the ballot evenly over its remaining candidates,
+    those shares are kept as exact fractions so tallies never drift.
+    """
+    def __init__(self, ballots, weights, nr_candidates, eliminations=()) -> None:
+        self.ballots = ballots
+        self.weights = weights
+        self.eliminated = set(eliminations)
+        self.nr_votes = [0] * nr_candidates
+        self.piles = [set() for _ in range(nr_candidates)]
+        self.level = [0] * len(ballots)                         # Position in the ballot currently counted
+        self.share = [[] for _ in range(len(ballots))]          # Candidates the ballot currently counts for
+        self.scanned = len(ballots)                             # Ballots (re)assigned so far, for tracing
+        for idx in range(len(ballots)):
+            self.assign(idx, 0)
+
+    def assign(self, idx, start):
+        """
+        Put ballot idx on the pile(s) of its first remaining choice at or after position start
+        """
+        level, share = first_choice(self.ballots[idx], self.eliminated, start)
+        self.place(idx, level, share)
+
+    def place(self, idx, level, share):
+        self.share[idx] = share
+        if len(share) == 0:
+            return                                              # Exhausted ballot
+        portion = self.weights[idx] if len(share) == 1 else Fraction(self.weights[idx], len(share))
+        for c in share:
+            self.nr_votes[c] += portion
+            self.piles[c].add(idx)
+        self.level[idx] = level
+
+    def withdraw(self, idx):
+        share = self.share[idx]
+        if len(share) == 0:
+            return
+        portion = self.weights[idx] if len(share) == 1 else Fraction(self.weights[idx], len(share))
+        for c in share:
+            self.nr_votes[c] -= portion
+            self.piles[c].discard(idx)
+
+    def eliminate(self, losers, undo=None):
+        """
+        Eliminate candidates and transfer the ballots on their piles
+        input:
+            losers: list of ints (candidates to eliminate)
+            undo: list, if given it records what restore needs to take the elimination back
+        output:
+            transferred: int (number of distinct ballots that moved)
+        """
+        self.eliminated.update(losers)
+        moving = set()
+        for loser in losers:
+            moving |= self.piles[loser]
+
+        for idx in moving:
+            if undo is not None:
+                undo.append((idx, self.level[idx], self.share[idx]))
+            self.withdraw(idx)
+            self.assign(idx, self.level[idx])
+        self.scanned += len(moving)
+        return len(moving)
+
+    def restore(self, losers, undo):
+        """
+        Take back eliminate(losers, undo): the transferred ballots return to the losers' piles
+        """
+        for idx, level, share in reversed(undo):
+            self.withdraw(idx)
+            self.place(idx, level, share)
+        self.eliminated.difference_update(losers)
+
+    def tally(self):
+        """
+        Current number of votes for each candidate, split votes as floats
+        """
+        return exact_votes(self.nr_votes)
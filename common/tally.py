@@ -0,0 +1,261 @@
+"""
+Running tallies for ballots that arrive in batches (early votes, precinct
+uploads). A tally keeps only counts per candidate, or per pair of candidates,
+so add_ballots and remove_ballots are one vectorised pass over the batch and
+the current scores, ranking and winners come from the counts in O(m) or
+O(m^2) without looking at a ballot again. Tallies of the same rule over the
+same candidates merge (merge, + or +=), so batches can be counted in other
+processes or on other machines and combined; tallies pickle as they are.
+"""
+from math import lcm
+import numpy as np
+from ballot_matrix import BallotMatrix
+from pairwise import matrix_pairwise, margins
+
+
+def as_matrix(data, weights, nr_candidates):
+    """
+    A batch of ballots as a BallotMatrix
+    input:
+        data: BallotMatrix, WeightedProfile or list of lists of ints (voters' votes, tie groups as lists)
+        weights: list of ints (number of voters casting each ballot), None for the profile's own or one each
+        nr_candidates: int
+    output:
+        matrix: BallotMatrix
+    """
+    if isinstance(data, BallotMatrix):
+        if weights is not None:
+            raise ValueError("a BallotMatrix carries its own weights")
+        if data.nr_candidates != nr_candidates:
+            raise ValueError(f"ballots over {data.nr_candidates} candidates, tally over {nr_candidates}")
+        return data
+    if weights is None:
+        weights = getattr(data, "weights", None)                # WeightedProfile
+    return BallotMatrix.from_ballots(list(data), weights, nr_candidates)
+
+
+class Tally:
+    """
+    Counts of one rule, kept in units of 1/scale like the tallies of BallotMatrix.
+    Subclasses say what a batch adds to the counts (counts) and how counts turn into scores (scores).
+    """
+    def __init__(self, nr_candidates) -> None:
+        self.nr_candidates = nr_candidates
+        self.scale = 1
+        self.nr_voters = 0
+        self.totals = np.zeros(nr_candidates, dtype=np.int64)
+
+    def counts(self, matrix):
+        """
+        What a batch adds to the totals
+        output:
+            counts: int array shaped like totals
+            scale: int (counts are in units of 1/scale)
+        """
+        raise NotImplementedError
+
+    def rescale(self, scale):
+        """
+        Move the totals to a scale that also counts units of 1/scale exactly
+        output:
+            factor: int (multiplier taking counts in units of 1/scale to the tally's units)
+        """
+        common = lcm(self.scale, scale)
+        if common != self.scale:
+            self.totals = self.totals * (common // self.scale)
+            self.scale = common
+        return common // scale
+
+    def add_ballots(self, data, weights=None):
+        self.update(as_matrix(data, weights, self.nr_candidates), 1)
+        return self
+
+    def remove_ballots(self, data, weights=None):
+        """
+        Take back ballots that were added before, e.g. a batch that was uploaded twice
+        """
+        self.update(as_matrix(data, weights, self.nr_candidates), -1)
+        return self
+
+    def update(self, matrix, sign):
+        counts, scale = self.counts(matrix)
+        factor = self.rescale(scale)
+        totals = self.totals + sign * factor * counts
+        nr_voters = self.nr_voters + sign * matrix.nr_voters()
+        if nr_voters < 0 or (totals < 0).any():
+            raise ValueError("removing ballots that were never added")
+        self.totals = totals
+        self.nr_voters = nr_voters
+
+    def merge(self, other):
+        """
+        Add the counts of a tally of the same rule, counted over other ballots
+        """
+        if type(other) is not type(self) or other.nr_candidates != self.nr_candidates:
+            raise ValueError("only tallies of the same rule over the same candidates merge")
+        factor = self.rescale(other.scale)
+        self.totals = self.totals + factor * other.totals
+        self.nr_voters += other.nr_voters
+        return self
+
+    def __iadd__(self, other):
+        return self.merge(other)
+
+    def __add__(self, other):
+        return self.copy().merge(other)
+
+    def copy(self):
+        tally = type(self)(self.nr_candidates)
+        tally.scale = self.scale
+        tally.nr_voters = self.nr_voters
+        tally.totals = self.totals.copy()
+        return tally
+
+    def scores(self):
+        """
+        Score of every candidate, split votes as floats like BallotMatrix.to_votes
+        """
+        return [p // self.scale if p % self.scale == 0 else p / self.scale for p in self.totals.tolist()]
+
+    def ranking(self):
+        scores = self.scores()
+        return [x[1] for x in sorted(((value, index) for index, value in enumerate(scores)), reverse=True)]
+
+    def winners(self):
+        """
+        Candidates with the highest score, all of them if they tie
+        """
+        scores = self.scores()
+        best = max(scores, default=None)
+        return [c for c, score in enumerate(scores) if score == best]
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({self.nr_voters} voters, scores={self.scores()})"
+
+
+class PluralityTally(Tally):
+    """
+    First preferences, a tie group at the top of a ballot splits its vote
+    """
+    def counts(self, matrix):
+        counted, share = matrix.first_choices(())
+        return matrix.count(counted, np.broadcast_to(share[:, None], matrix.ranks.shape)), matrix.scale
+
+
+class ApprovalTally(Tally):
+    """
+    One point for every candidate listed on a ballot
+    """
+    def counts(self, matrix):
+        return np.asarray(matrix.approval_scores(), dtype=np.int64), 1
+
+
+class BordaTally(Tally):
+    """
+    m-1 points for the first level of a ballot, m-2 for the second...
+    """
+    def counts(self, matrix):
+        return np.asarray(matrix.borda_scores(), dtype=np.int64), 1
+
+
+class PairwiseTally(Tally):
+    """
+    Pairwise majority matrix, totals[a, b] voters prefer a over b. The scores are
+    the Copeland scores of finalSCFs (the sum of the pairwise margins of each candidate).
+    """
+    def __init__(self, nr_candidates) -> None:
+        super().__init__(nr_candidates)
+        self.totals = np.zeros((nr_candidates, nr_candidates), dtype=np.int64)
+
+    def counts(self, matrix):
+        return matrix_pairwise(matrix), 1
+
+    def pairwise(self):
+        return self.totals.tolist()
+
+    def scores(self):
+        return margins(self.totals).sum(axis=1).tolist()
+
+    def condorcet_winner(self):
+        """
+        Candidate beating every other candidate head to head, None if there is none
+        """
+        beats = (self.totals > self.totals.T).sum(axis=1)
+        winners = np.flatnonzero(beats == self.nr_candidates - 1)
+        return int(winners[0]) if len(winners) > 0 else None
+
+
+class STVTally(PluralityTally):
+    """
+    First preferences of the first STV round. Later rounds transfer ballots, so the
+    tally also keeps every distinct ballot with its number of voters; profile()
+    hands them to STV as a BallotMatrix, which costs the number of distinct
+    ballots instead of the number of voters.
+    """
+    def __init__(self, nr_candidates) -> None:
+        super().__init__(nr_candidates)
+        self.ballots = {}                                       # (ranks, levels) of a ballot to its number of voters
+
+    def update(self, matrix, sign):
+        changes = {}
+        for key, weight in distinct_ballots(matrix):
+            changes[key] = self.ballots.get(key, 0) + sign * weight
+        if any(weight < 0 for weight in changes.values()):
+            raise ValueError("removing ballots that were never added")
+        super().update(matrix, sign)
+        self.apply(changes)
+
+    def merge(self, other):
+        super().merge(other)
+        self.apply({key: self.ballots.get(key, 0) + weight for key, weight in other.ballots.items()})
+        return self
+
+    def apply(self, changes):
+        for key, weight in changes.items():
+            if weight == 0:
+                self.ballots.pop(key, None)
+            else:
+                self.ballots[key] = weight
+
+    def copy(self):
+        tally = super().copy()
+        tally.ballots = self.ballots.copy()
+        return tally
+
+    def first_preferences(self):
+        return self.scores()
+
+    def profile(self):
+        """
+        Every ballot counted so far, for STV(tally.profile(), names)
+        output:
+            matrix: BallotMatrix (one row per distinct ballot)
+        """
+        width = max((len(ranks) for ranks, _ in self.ballots), default=0)
+        ranks = np.full((len(self.ballots), width), -1, dtype=np.int32)
+        levels = np.full((len(self.ballots), width), -1, dtype=np.int32)
+        max_tie = 1
+        for i, (row, row_levels) in enumerate(self.ballots):
+            ranks[i, :len(row)] = row
+            levels[i, :len(row)] = row_levels
+            if len(row_levels) > 0:
+                max_tie = max(max_tie, int(np.bincount(row_levels).max()))
+        return BallotMatrix(ranks, levels, list(self.ballots.values()), self.nr_candidates, max_tie)
+
+
+def distinct_ballots(matrix):
+    """
+    Distinct ballots of a matrix with their total number of voters
+    output:
+        ballots: list of tuples ((ranks, levels) without padding, int)
+    """
+    if len(matrix) == 0:
+        return []
+    rows, inverse = np.unique(np.hstack([matrix.ranks, matrix.levels]), axis=0, return_inverse=True)
+    weights = np.bincount(inverse.reshape(-1), weights=matrix.weights, minlength=len(rows))
+    width = matrix.ranks.shape[1]
+    ballots = []
+    for row, weight in zip(rows, np.rint(weights).astype(np.int64).tolist()):
+        length = int((row[:width] >= 0).sum())
+        ballots.append(((tuple(row[:length].tolist()), tuple(row[width:width + length].tolist())), weight))
+    return ballots
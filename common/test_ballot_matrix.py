@@ -0,0 +1,22 @@
+from ballot_matrix import BallotMatrix
+from tally import PluralityTally
+
+
+def test_empty_ballots_are_exhausted():
+    matrix = BallotMatrix.from_ballots([[], []], [2, 1], 3)
+    assert matrix.ranks.shape == (2, 0)
+    assert matrix.first_preferences([]) == [0, 0, 0]
+
+    count = matrix.stv_count()
+    assert count.tally() == [0, 0, 0]
+    count.eliminate([2])
+    assert count.tally() == [0, 0, 0]
+
+    tally = PluralityTally(3).add_ballots(matrix)
+    assert tally.scores() == [0, 0, 0]
+    assert tally.nr_voters == 3
+
+
+def test_no_ballots():
+    matrix = BallotMatrix.from_ballots([], None, 3)
+    assert matrix.first_preferences([]) == [0, 0, 0]
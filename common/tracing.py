@@ -0,0 +1,166 @@
+"""
+Opt-in instrumentation. Nothing is recorded until enable is called (or the
+TRACE_FILE environment variable is set), until then span hands out one shared
+no-op object and the STV loops only test TRACER against None once per round.
+Every event is a Chrome trace "complete" event written as one line, so the
+file can be aggregated line by line (summarize) or, written with chrome=True,
+opened in chrome://tracing or Perfetto as is.
+"""
+import atexit
+import json
+import os
+import sys
+import time as t
+
+TRACER = None                                                   # The enabled Tracer, None when tracing is off
+
+
+class Tracer:
+    """
+    Writes events to a file, a "{pid}" in the filename gives every process its own
+    file, otherwise processes append whole lines to the same one. Forked processes
+    reopen the file instead of sharing the parent's buffer.
+    """
+    def __init__(self, filename, chrome=False) -> None:
+        self.filename = filename
+        self.chrome = chrome
+        self.f = None
+        self.pid = None
+        self.open()
+
+    def open(self):
+        self.pid = os.getpid()
+        filename = self.filename.replace("{pid}", str(self.pid))
+        new = not os.path.exists(filename) or os.path.getsize(filename) == 0
+        self.f = open(filename, "a", buffering=1)               # Line buffered, events reach the file whole
+        if self.chrome and new:
+            self.f.write("[\n")                                 # The closing ] is optional in the trace event format
+
+    def clock(self):
+        return t.perf_counter()
+
+    def complete(self, name, start, category="", **args):
+        """
+        Record an event that began at start (a clock() value) and ends now
+        """
+        end = t.perf_counter()
+        if os.getpid() != self.pid:
+            self.open()
+        event = {"name": name, "cat": category, "ph": "X", "ts": round(start * 1e6, 3),
+                 "dur": round((end - start) * 1e6, 3), "pid": self.pid, "tid": 0, "args": args}
+        self.f.write(json.dumps(event, default=int) + (",\n" if self.chrome else "\n"))
+
+    def close(self):
+        if self.f is not None and os.getpid() == self.pid:
+            self.f.close()
+        self.f = None
+
+
+class Span:
+    """
+    Times a with block as one event
+    """
+    __slots__ = ("tracer", "name", "category", "args", "start")
+
+    def __init__(self, tracer, name, category, args) -> None:
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.args = args
+
+    def __enter__(self):
+        self.start = self.tracer.clock()
+        return self
+
+    def __exit__(self, *exception):
+        self.tracer.complete(self.name, self.start, self.category, **self.args)
+
+
+class NoSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        pass
+
+
+NO_SPAN = NoSpan()
+
+
+def span(name, category="", **args):
+    """
+    with span("name"): ... records the block when tracing is enabled
+    """
+    if TRACER is None:
+        return NO_SPAN
+    return Span(TRACER, name, category, args)
+
+
+def enable(filename, chrome=False):
+    """
+    Start writing events to filename (JSON lines, or a Chrome trace if chrome is True)
+    """
+    global TRACER
+    disable()
+    TRACER = Tracer(filename, chrome)
+    return TRACER
+
+
+def disable():
+    global TRACER
+    if TRACER is not None:
+        TRACER.close()
+    TRACER = None
+
+
+def load(filename):
+    """
+    Events of a trace file of either format
+    """
+    events = []
+    with open(filename) as f:
+        for line in f:
+            line = line.strip().rstrip(",")
+            if line not in ["", "[", "]"]:
+                events.append(json.loads(line))
+    return events
+
+
+def summarize(filenames):
+    """
+    Totals per event name over any number of trace files
+    output:
+        summary: dict of names to dicts (count, total/mean/max seconds, and the sum of every
+                 numeric argument but the round number, e.g. ballots_scanned of the STV rounds)
+    """
+    summary = {}
+    for filename in filenames:
+        for event in load(filename):
+            entry = summary.setdefault(event["name"], {"count": 0, "seconds": 0.0, "max_seconds": 0.0})
+            seconds = event["dur"] / 1e6
+            entry["count"] += 1
+            entry["seconds"] += seconds
+            entry["max_seconds"] = max(entry["max_seconds"], seconds)
+            for key, value in event.get("args", {}).items():
+                if type(value) in [int, float] and key != "round":
+                    entry[key] = entry.get(key, 0) + value
+    for entry in summary.values():
+        entry["mean_seconds"] = entry["seconds"] / entry["count"]
+    return summary
+
+
+atexit.register(disable)
+if os.environ.get("TRACE_FILE"):
+    enable(os.environ["TRACE_FILE"], os.environ.get("TRACE_FORMAT") == "chrome")
+
+
+if __name__ == "__main__":
+    # python tracing.py trace-*.jsonl: time spent per event over all files
+    summary = summarize(sys.argv[1:])
+    for name, entry in sorted(summary.items(), key=lambda item: -item[1]["seconds"]):
+        extra = ", ".join(f"{key}: {value}" for key, value in entry.items()
+                          if key not in ["count", "seconds", "max_seconds", "mean_seconds"])
+        print(f"{name}: {entry['count']}x, {entry['seconds']:.4f}s total, {entry['mean_seconds'] * 1e3:.3f}ms mean, "
+              f"{entry['max_seconds'] * 1e3:.3f}ms max" + (f", {extra}" if extra else ""))
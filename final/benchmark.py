@@ -0,0 +1,335 @@
+"""
+Scaling benchmarks for the social choice functions and welfares of both
+assignments. The cases run one after the other in a worker process that has
+both trees (and the modules they share in ../common) on its path, every case
+first timed without tracing, then once more under tracemalloc for its memory use.
+A case that times out takes its worker down, the next case gets a fresh one.
+
+    python benchmark.py                              full grid, printed
+    python benchmark.py --voters 1000 10000 --save   record a baseline
+    python benchmark.py --voters 1000 10000 --check  compare with the baseline
+"""
+import argparse
+import json
+import platform
+import sys
+import time as t
+import tracemalloc
+from itertools import product
+from multiprocessing import get_context, TimeoutError
+from os import path, sep
+
+cwd = path.dirname(path.abspath(__file__))
+A3 = path.join(path.dirname(cwd), "a3")
+COMMON = path.join(path.dirname(cwd), "common")
+
+BASELINE = cwd + sep + "benchmark_baseline.json"
+REAL_DATA = "00016-00000001.toi"
+
+# target: (rules, profile sources)
+TARGETS = {
+    "final": (["plurality", "stv", "approval", "condorcet", "borda", "copeland"], ["ic", "election", "real"]),
+    "final_election": (["equalshares"], ["election"]),
+    "welfare": (["utalitarian", "chamberlin", "egalitarian", "nash"], ["election"]),
+    "a3": (["stv", "stv_tree", "stv_tree_unpruned"], ["ic", "real"])
+}
+WELFARE_FUNCTIONS = {
+    "utalitarian": "utalitarian_welfare",
+    "chamberlin": "chamberlin_courant_welfare",
+    "egalitarian": "egalitarian_social_welfare",
+    "nash": "nash_welfare"
+}
+VOTERS = [10**3, 10**4, 10**5, 10**6, 10**7]
+CANDIDATES = [4, 20, 100, 500]
+LENGTHS = [None, 10]                                            # None is a complete ranking
+MAX_ENTRIES = 2 * 10**7                                         # voters x candidates above which a case is skipped
+MAX_TREE_CANDIDATES = 8                                         # STV_tree grows with the number of elimination orders
+MAX_TREE_VOTERS = 10**5
+TREE_CANDIDATES = [5, 7]                                        # Also run for the trees, pruning pays from 6 candidates on
+
+TOLERANCE = 0.25                                                # Allowed slowdown / growth before a regression is flagged
+MIN_TIME = 0.005                                                # Faster cases are too noisy to compare
+METRICS = ["seconds", "peak_bytes"]
+
+
+def case_id(case):
+    length = "full" if case["length"] is None else case["length"]
+    if case["source"] == "real":
+        return f"{case['target']}.{case['rule']}/real"
+    return f"{case['target']}.{case['rule']}/{case['source']}/v={case['voters']}/c={case['candidates']}/l={length}"
+
+
+def grid(voters=VOTERS, candidates=CANDIDATES, lengths=LENGTHS, targets=None, max_entries=MAX_ENTRIES):
+    """
+    Every case of the grid
+    output:
+        cases: list of dicts (target, rule, source, voters, candidates, length)
+        skipped: list of (case, reason) tuples
+    """
+    cases, skipped, seen = [], [], set()
+    for target, (rules, sources) in TARGETS.items():
+        for rule, source in product(rules, sources):
+            if targets and not any(f"{target}.{rule}".startswith(name) for name in targets):
+                continue
+            if source == "real":
+                case = {"target": target, "rule": rule, "source": source, "voters": None, "candidates": None, "length": None}
+                if rule.startswith("stv_tree"):
+                    skipped.append((case, "tree too large"))     # Every elimination order of 11 candidates
+                else:
+                    cases.append(case)
+                continue
+            sizes = candidates + TREE_CANDIDATES if rule.startswith("stv_tree") else candidates
+            for v, c, length in product(voters, sizes, lengths if source == "ic" else [None]):
+                if length is not None and length >= c:
+                    continue                                    # Same as a complete ranking
+                case = {"target": target, "rule": rule, "source": source, "voters": v, "candidates": c, "length": length}
+                if case_id(case) in seen:
+                    continue
+                seen.add(case_id(case))
+                if v * c > max_entries:
+                    skipped.append((case, f"more than {max_entries} entries"))
+                elif rule.startswith("stv_tree") and (c > MAX_TREE_CANDIDATES or v > MAX_TREE_VOTERS):
+                    skipped.append((case, "tree too large"))
+                else:
+                    cases.append(case)
+    return cases, skipped
+
+
+def impartial_culture(voters, candidates, length, seed):
+    """
+    One ballot per voter drawn uniformly at random, cut off after length candidates
+    output:
+        matrix: BallotMatrix
+    """
+    import generators
+    ranks = generators.impartial_culture(voters, candidates, seed)
+    return generators.matrix(ranks if length is None else ranks[:, :length], candidates, merge=False)
+
+
+def prepare_final(case, seed):
+    """
+    Function running one case of the final project, everything it needs is built beforehand
+    """
+    import finalSCFs
+    import welfares
+    from final_project import build_election, applyBudgetMaximally, BallotType
+    from ballot_matrix import BallotMatrix
+
+    rule, source = case["rule"], case["source"]
+    election = None
+    if source == "ic":
+        names = list(range(case["candidates"]))
+        data = impartial_culture(case["voters"], case["candidates"], case["length"], seed)
+    elif source == "real":
+        from preflib import PreflibFile
+        with PreflibFile(path.join(A3, REAL_DATA)) as parsed:
+            ballots, weights = zip(*parsed)
+            names = list(range(len(parsed.names)))
+        data = BallotMatrix.from_ballots(list(ballots), list(weights), len(names))
+    else:
+        election = build_election(seed, case["voters"], case["candidates"])
+        names = list(range(len(election.projects)))
+        data = election.population.ballots(BallotType.FULL_RANKING if rule == "stv" else BallotType.PARTIAL_RANKING)
+
+    if case["target"] == "welfare":
+        outcome = applyBudgetMaximally(election, finalSCFs.approval(data, names))
+        welfare = getattr(welfares, WELFARE_FUNCTIONS[rule])
+        return lambda: welfare(election, outcome)
+    if rule == "equalshares":
+        return lambda: finalSCFs.equalshares(election)
+    if rule == "plurality":
+        return lambda: finalSCFs.plurality(data, names, standalone=True)
+    return lambda: getattr(finalSCFs, rule.upper() if rule == "stv" else rule)(data, names)
+
+
+def prepare_a3(case, seed):
+    """
+    Function running one case of a3, everything it needs is built beforehand
+    """
+    import main
+    import trees
+    from generators import matrix, to_ballots
+    from profiles import WeightedProfile
+
+    if case["source"] == "real":
+        data, names = main.load_data(REAL_DATA)
+    else:
+        data = impartial_culture(case["voters"], case["candidates"], case["length"], seed)
+        names = {c: str(c) for c in range(case["candidates"])}
+        if case["rule"].startswith("stv_tree"):
+            data = WeightedProfile(*to_ballots(matrix(data.ranks, len(names))))
+
+    if case["rule"] == "stv":
+        return lambda: main.STV(data, names)
+    winners = main.STV(data, names)
+    prune = case["rule"] == "stv_tree"                          # stv_tree_unpruned shows what pruning saves
+    return lambda: trees.STV_tree(data, names, old_winners=winners, prune=prune)
+
+
+def put_on_path():
+    """
+    Make the modules of both trees importable, their names do not clash
+    """
+    for directory in [cwd, A3, COMMON]:
+        if directory not in sys.path:
+            sys.path.append(directory)
+
+
+def run_case(case, repeat=3, seed=1):
+    """
+    Measure a single case, meant to run in a worker process
+    output:
+        metrics: dict (best wall time of repeat runs, peak traced memory of one run,
+                 blocks still allocated after it)
+    """
+    run = prepare_a3(case, seed) if case["target"] == "a3" else prepare_final(case, seed)
+
+    times = []
+    for _ in range(repeat):
+        start = t.perf_counter()
+        run()
+        times.append(t.perf_counter() - start)
+        if sum(times) > 10:                                     # Slow cases need fewer runs to be stable
+            break
+
+    tracemalloc.start()
+    blocks = sys.getallocatedblocks()
+    result = run()
+    _, peak = tracemalloc.get_traced_memory()
+    blocks = sys.getallocatedblocks() - blocks
+    tracemalloc.stop()
+    del result
+
+    return {
+        "seconds": min(times),
+        "runs": len(times),
+        "peak_bytes": peak,
+        "allocated_blocks": blocks
+    }
+
+
+def run_benchmarks(cases, repeat=3, timeout=600, progress=None):
+    """
+    Run every case in a worker process, a new one after a timeout
+    output:
+        results: dict of case ids to metrics (or to {"status": "timeout"/"error", ...})
+    """
+    context = get_context("spawn")
+    pool = None
+    results = {}
+    try:
+        for i, case in enumerate(cases):
+            if pool is None:
+                pool = context.Pool(1, initializer=put_on_path)
+            try:
+                metrics = pool.apply_async(run_case, (case, repeat)).get(timeout)
+                metrics["status"] = "ok"
+            except TimeoutError:
+                metrics = {"status": "timeout"}
+                pool.terminate()                                # The case is still running
+                pool = None
+            except Exception as error:
+                metrics = {"status": "error", "error": repr(error)}
+            results[case_id(case)] = dict(case, **metrics)
+            if progress is not None:
+                progress(i + 1, len(cases), case_id(case), metrics)
+    finally:
+        if pool is not None:
+            pool.terminate()
+    return results
+
+
+def save_results(results, filename):
+    with open(filename, "w") as f:
+        json.dump({
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "processor": platform.processor(),
+            "cases": results
+        }, f, indent=1, sort_keys=True)
+
+
+def load_results(filename):
+    with open(filename) as f:
+        return json.load(f)["cases"]
+
+
+def regressions(results, baseline, tolerance=TOLERANCE, min_time=MIN_TIME):
+    """
+    Cases that got slower or use more memory than in the baseline
+    output:
+        regressions: list of (case id, metric, baseline value, new value) tuples
+    """
+    found = []
+    for key, metrics in results.items():
+        old = baseline.get(key)
+        if old is None or old.get("status") != "ok":
+            continue
+        if metrics.get("status") != "ok":
+            found.append((key, "status", old["status"], metrics.get("status")))
+            continue
+        for metric in METRICS:
+            if metric == "seconds" and max(old[metric], metrics[metric]) < min_time:
+                continue
+            if metrics[metric] > old[metric] * (1 + tolerance):
+                found.append((key, metric, old[metric], metrics[metric]))
+    return found
+
+
+def bottlenecks(results):
+    """
+    Slowest rule of every grid point (source, voters, candidates, length)
+    """
+    slowest = {}
+    for key, metrics in results.items():
+        if metrics.get("status") != "ok":
+            continue
+        point = (metrics["source"], metrics["voters"], metrics["candidates"], metrics["length"])
+        if point not in slowest or metrics["seconds"] > slowest[point][1]:
+            slowest[point] = (f"{metrics['target']}.{metrics['rule']}", metrics["seconds"])
+    return slowest
+
+
+def print_progress(done, total, key, metrics):
+    if metrics["status"] == "ok":
+        print(f"[{done}/{total}] {key}: {metrics['seconds']:.4f}s, peak {metrics['peak_bytes'] / 2**20:.1f} MiB, "
+              f"{metrics['allocated_blocks']} blocks")
+    else:
+        print(f"[{done}/{total}] {key}: {metrics['status']} {metrics.get('error', '')}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Scaling benchmarks of every rule and welfare")
+    parser.add_argument("--voters", type=int, nargs="+", default=VOTERS)
+    parser.add_argument("--candidates", type=int, nargs="+", default=CANDIDATES)
+    parser.add_argument("--lengths", type=int, nargs="+", default=LENGTHS, help="ballot lengths of the ic profiles (complete rankings always run)")
+    parser.add_argument("--targets", nargs="+", help="only cases starting with these, e.g. final.borda a3")
+    parser.add_argument("--max-entries", type=int, default=MAX_ENTRIES)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--timeout", type=float, default=600)
+    parser.add_argument("--output", help="write the results to this file")
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument("--save", action="store_true", help="store the results as the baseline")
+    parser.add_argument("--check", action="store_true", help="exit with 1 when a case regressed against the baseline")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE)
+    args = parser.parse_args()
+
+    lengths = sorted(set(args.lengths) | {None}, key=lambda length: -1 if length is None else length)
+    cases, skipped = grid(args.voters, args.candidates, lengths, args.targets, args.max_entries)
+    for case, reason in skipped:
+        print(f"Skipping {case_id(case)}: {reason}")
+    results = run_benchmarks(cases, args.repeat, args.timeout, print_progress)
+
+    print("\nSlowest rule per profile:")
+    for (source, voters, candidates, length), (rule, seconds) in sorted(bottlenecks(results).items(), key=str):
+        print(f"{source}\tv={voters}\tc={candidates}\tl={length}\t{rule}\t{seconds:.4f}s")
+
+    if args.output:
+        save_results(results, args.output)
+    if args.save:
+        save_results(results, args.baseline)
+    if args.check:
+        found = regressions(results, load_results(args.baseline), args.tolerance)
+        for key, metric, old, new in found:
+            print(f"Regression {key} {metric}: {old} -> {new}")
+        sys.exit(1 if len(found) > 0 else 0)
@@ -0,0 +1,138 @@
+from functools import lru_cache
+from math import gcd, floor
+
+METHODS = ["rank", "ratio", "knapsack", "fptas"]
+MAX_BUCKETS = 100000                                            # Largest cost DP table before costs get bucketed
+
+
+def positional_scores(ranking):
+    """
+    Value of every ranked project when a rule only gives a ranking, the first of k projects is worth k
+    """
+    return [len(ranking) - position for position in range(len(ranking))]
+
+
+def greedy_by_rank(costs, ranking, budget):
+    """
+    Walk the ranking and take every project that still fits
+    """
+    chosen = []
+    for project in ranking:
+        if costs[project] > budget:
+            continue
+        budget -= costs[project]
+        chosen.append(project)
+    return chosen
+
+
+def greedy_by_ratio(costs, ranking, budget, scores):
+    """
+    Take projects by score per unit of cost, ties broken by rank
+    """
+    order = sorted(range(len(ranking)), key=lambda i: -scores[i] / costs[ranking[i]] if costs[ranking[i]] > 0 else float("-inf"))
+    chosen = set(greedy_by_rank(costs, [ranking[i] for i in order], budget))
+    return [project for project in ranking if project in chosen]
+
+
+def knapsack(costs, ranking, budget, scores, max_buckets=MAX_BUCKETS):
+    """
+    Projects of maximal total score that fit the budget, by dynamic programming over cost.
+    Costs are counted in units of their greatest common divisor, which is exact; when
+    the budget would need more than max_buckets units, costs are rounded up to buckets
+    of budget / max_buckets, which keeps the outcome feasible but may miss the optimum.
+    """
+    unit = 0
+    for project in ranking:
+        if not float(costs[project]).is_integer():
+            unit = 0
+            break
+        unit = gcd(unit, int(costs[project]))
+    if unit == 0 or budget / unit > max_buckets:
+        unit = budget / max_buckets if budget > 0 else 1
+    capacity = int(floor(budget / unit + 1e-9))
+    weights = [-(-costs[project] // unit) for project in ranking]   # Round up, never over the budget
+
+    best = [0] * (capacity + 1)
+    taken = []                                                  # taken[i][c]: item i used in the best fill of c
+    for i, weight in enumerate(weights):
+        weight = int(weight)
+        row = bytearray(capacity + 1)
+        for c in range(capacity, weight - 1, -1):
+            if best[c - weight] + scores[i] > best[c]:
+                best[c] = best[c - weight] + scores[i]
+                row[c] = 1
+        taken.append(row)
+
+    chosen = set()
+    c = capacity
+    for i in range(len(ranking) - 1, -1, -1):
+        if taken[i][c]:
+            chosen.add(ranking[i])
+            c -= int(weights[i])
+    return [project for project in ranking if project in chosen]
+
+
+def knapsack_fptas(costs, ranking, budget, scores, epsilon=0.1):
+    """
+    Knapsack approximation whose running time does not depend on the budget:
+    scores are scaled down to integers and the DP finds the cheapest way to reach
+    every scaled score. The outcome is worth at least (1 - epsilon) times the optimum.
+    """
+    items = [i for i in range(len(ranking)) if costs[ranking[i]] <= budget]
+    if len(items) == 0:
+        return []
+    scale = epsilon * max(scores[i] for i in items) / len(items)
+    values = [int(scores[i] // scale) for i in items]
+
+    total = sum(values)
+    cheapest = [0] + [float("inf")] * total                     # cheapest[v]: lowest cost reaching scaled score v
+    taken = []
+    for item, value in zip(items, values):
+        cost = costs[ranking[item]]
+        row = bytearray(total + 1)
+        for v in range(total, value - 1, -1):
+            if cheapest[v - value] + cost < cheapest[v]:
+                cheapest[v] = cheapest[v - value] + cost
+                row[v] = 1
+        taken.append(row)
+
+    v = max(v for v in range(total + 1) if cheapest[v] <= budget)
+    chosen = set()
+    for k in range(len(items) - 1, -1, -1):
+        if taken[k][v]:
+            chosen.add(ranking[items[k]])
+            v -= values[k]
+    return [project for project in ranking if project in chosen]
+
+
+@lru_cache(maxsize=4096)
+def cached_allocation(method, ranking, costs, budget, scores):
+    """Allocation for hashable (tuple) arguments, see allocate"""
+    if method == "rank":
+        return greedy_by_rank(costs, ranking, budget)
+    if method == "ratio":
+        return greedy_by_ratio(costs, ranking, budget, scores)
+    if method == "knapsack":
+        return knapsack(costs, ranking, budget, scores)
+    if method == "fptas":
+        return knapsack_fptas(costs, ranking, budget, scores)
+    raise ValueError(f"Unknown budget allocation {method}")
+
+
+def allocate(costs, ranking, budget, method="rank", scores=None):
+    """
+    Projects of a rule's outcome that are funded with the budget.
+    Results are cached per (method, ranking, costs, budget, scores), every rule
+    of a simulation shares the same costs and budget and rules often agree.
+    input:
+        costs: list of numbers (cost of each project)
+        ranking: list of ints (projects, best first)
+        budget: number
+        method: string, one of METHODS
+        scores: list of numbers (value of each ranked project), defaults to positional_scores
+    output:
+        chosen: list of ints (funded projects, in ranking order)
+    """
+    ranking = tuple(ranking)
+    scores = tuple(positional_scores(ranking) if scores is None else scores)
+    return list(cached_allocation(method, ranking, tuple(costs), budget, scores))
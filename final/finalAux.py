@@ -3,20 +3,12 @@ def tied_vote(vote, eliminations):
     Resolve a tied vote
     input:
         vote: list of ints (candidates)
-        eliminations: list of ints (candidates that have been eliminated)
+        eliminations: Eliminations or list of ints (candidates that have been eliminated)
     output:
         vote: list of ints (candidates)"""
 
-    # print(vote)
-    if len(vote) == 1:
-        return None if vote[0] in eliminations else [vote[0]]
-    if vote[0] in eliminations and vote[1] in eliminations:
-        return None
-    if vote[0] in eliminations:
-        return [vote[1]]
-    if vote[1] in eliminations:
-        return [vote[0]]
-    return vote
+    remaining = [c for c in vote if c not in eliminations]      # Tie groups can hold any number of candidates
+    return remaining if len(remaining) > 0 else None
 
 def checkrank(ballot, a, b):
     if a in ballot and b in ballot:
@@ -27,4 +19,3 @@ def checkrank(ballot, a, b):
         return -1
     else:
         return 0
-    
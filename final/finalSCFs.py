@@ -1,34 +1,64 @@
 from collections import Counter
-
-def plurality(data, names, eliminations=[], standalone = False):
+from fractions import Fraction
+from finalAux import tied_vote
+import common_path
+from stv import STVCount, exact_votes
+from eliminations import Eliminations, as_eliminations
+import tracing
+from ballot_matrix import BallotMatrix
+from scan import ProfileScan
+from mes import equal_shares, equal_shares_completed
+from pairwise import pairwise_matrix, majority_graph, margins, strongest_paths, ranked_pairs_graph
+
+def plurality(data, names, eliminations=None, standalone = False):
     """
     Plurality voting
     input:
-        data: list of lists of ints (voters' votes)
+        data: list of lists of ints (voters' votes), BallotMatrix or ProfileScan
         names: dict of ints to strings (candidate names)
-        eliminations: list of ints (candidates that have been eliminated)
+        eliminations: Eliminations or list of ints (candidates that have been eliminated)
     output:
         winners: list of ints (candidate(s) with most votes)
         losers: list of ints (candidate(s) with least votes)
     """
+    eliminations = as_eliminations(eliminations)                # O(1) membership for every ballot
+    if isinstance(data, ProfileScan):
+        if len(eliminations) == 0:
+            return plurality_result(data.first_preferences(), eliminations, standalone)
+        data = data.matrix
+    if isinstance(data, BallotMatrix):
+        return plurality_result(data.first_preferences(eliminations), eliminations, standalone)
+
     nr_votes = [0] * len(names)
 
     for ballot in data:                                         # For each ballot
         for candidate in ballot:                                # For first eligible candidate in the vote
             if type(candidate) == list:                         # In case of Split vote
                 result = tied_vote(candidate, eliminations)
-                if result is None:                              # Both candidates were eliminated,
+                if result is None:                              # All tied candidates were eliminated,
                     continue                                    # continue to next candidate in ballot
                 for c in result:
-                    nr_votes[c] += 1/len(result)                # Add weighted vote to one or both candidates
-                    break
-                continue                                        # Both candidates were eliminated, continue to next candidate
+                    nr_votes[c] += Fraction(1, len(result))     # Split the vote over the remaining tied candidates
+                break
             if candidate not in eliminations:
                 nr_votes[candidate] += 1                        # Add vote to single candidate
                 break
 
+    return plurality_result(exact_votes(nr_votes), eliminations, standalone)
+
+def plurality_result(nr_votes, eliminations=None, standalone = False):
+    """
+    Winners and losers of a plurality round
+    input:
+        nr_votes: list of ints (number of votes for each candidate)
+        eliminations: Eliminations or list of ints (candidates that have been eliminated)
+    output:
+        winners: list of ints (candidate(s) with most votes)
+        losers: list of ints (candidate(s) with least votes)
+    """
+    eliminations = as_eliminations(eliminations)
     # Find the winners and losers
-    max_votes = max([i for i in nr_votes if nr_votes.index(i) not in eliminations])               # max(nr_votes) belongs to winner
+    max_votes = max(nr_votes[i] for i in range(len(nr_votes)) if i not in eliminations) # max(nr_votes) belongs to winner
     winners = [i for i in range(len(nr_votes)) if nr_votes[i] == max_votes]       # Find index of winners
     
     # Find the losers
@@ -47,24 +77,47 @@ def plurality(data, names, eliminations=[], standalone = False):
     
     return winners, losers
 
-def STV(data, names, eliminations=[]):
+def STV(data, names, eliminations=None, rounds=None):
 
     """
     Single Transferable Vote
     input:
-        data: list of lists of ints (voters' votes)
+        data: list of lists of ints (voters' votes) or BallotMatrix
         names: dict of ints to strings (candidate names)
-        eliminations: list of ints (candidates to be eliminated)
+        eliminations: Eliminations or list of ints (candidates to be eliminated), left unchanged
+        rounds: list, if given the tallies of every round are appended to it
+    output:
+        ranking: list of ints (winner first, then in reverse order of elimination)
     """
-    winners, losers = plurality(data, names, eliminations)
-    eliminations += losers                                     # Add the eliminated candidates to the list of eliminations
-    if len(losers) == 0: 
-        eliminations.extend(winners)
-        return eliminations[::-1]                                          # No more candidates to eliminate, final round
-    return STV(data, names, eliminations) 
+    eliminations = Eliminations(() if eliminations is None else eliminations)
+    tracer = tracing.TRACER                                    # None unless tracing is enabled
+    if tracer is not None:
+        start, scanned, round_nr = tracer.clock(), 0, 0
+    if isinstance(data, BallotMatrix):
+        count = data.stv_count(eliminations)
+    else:
+        count = STVCount(data, [1] * len(data), len(names), eliminations)
+    while True:
+        nr_votes = count.tally()
+        winners, losers = plurality_result(nr_votes, eliminations)
+        if rounds is not None:
+            rounds.append({"nr_votes": nr_votes, "eliminated": losers})
+        eliminations += losers                                 # Add the eliminated candidates to the list of eliminations
+        transferred = count.eliminate(losers) if len(losers) > 0 else 0 # Only move the ballots of the eliminated candidates
+        if tracer is not None:
+            tracer.complete("stv.round", start, "final", round=round_nr, ballots_scanned=count.scanned - scanned,
+                            ballots_transferred=transferred, eliminated=losers)
+            start, scanned, round_nr = tracer.clock(), count.scanned, round_nr + 1
+        if len(losers) == 0: 
+            eliminations.extend(winners)
+            return eliminations[::-1]                                      # No more candidates to eliminate, final round
 
 def approval(data,names):
     
+    if isinstance(data, (BallotMatrix, ProfileScan)):
+        nr_votes = data.approval_scores()
+        return([x[1] for x in sorted(((value, index) for index, value in enumerate(nr_votes)), reverse=True)])
+
     nr_votes = [0] * len(names)                                 # everyone starts with zero votes
 
     for ballot in data:
@@ -73,30 +126,11 @@ def approval(data,names):
 
     return([x[1] for x in sorted(((value, index) for index, value in enumerate(nr_votes)), reverse=True)]) # return winner
 
-def condorcet(data,names):
-
-    candidate_wins = [[0 for i in range(len(names))] for j in range(len(names))] # start with empty matrix
-
-    for i in names:
-        for j in names[names.index(i)+1:]: # pairwise comparison of candidates
-            if j == i:
-                continue
-            wins_i = 0
-            wins_j = 0
-            for ballot in data:            # count wins against each other
-                if i in ballot and j in ballot:
-                    if ballot.index(i) < ballot.index(j):
-                        wins_i += 1
-                    else:
-                        wins_j += 1
-                elif i in ballot:
-                    wins_i += 1
-                elif j in ballot:
-                    wins_j += 1                      
-            if wins_i > wins_j:          # mark winner in matrix
-                candidate_wins[i][j] = 1
-            elif wins_i < wins_j:
-                candidate_wins[j][i] = 1
+def condorcet(data,names,pairwise=None):
+
+    if pairwise is None:
+        pairwise = pairwise_of(data, names)                      # voters preferring i over j for every pair
+    candidate_wins = majority_graph(pairwise)                   # mark the winner of every pair in a matrix
     
     results = []
     i = 1
@@ -110,6 +144,10 @@ def condorcet(data,names):
 
 def borda(data, names):
 
+    if isinstance(data, (BallotMatrix, ProfileScan)):
+        points = data.borda_scores()
+        return([x[1] for x in sorted(((value, index) for index, value in enumerate(points)), reverse=True)])
+
     points = [0] * len(names) # empty list of points
 
     for ballot in data:
@@ -118,31 +156,85 @@ def borda(data, names):
 
     return([x[1] for x in sorted(((value, index) for index, value in enumerate(points)), reverse=True)])
 
-def copeland(data,names):
+def dowdall(data, names):
+
+    scan = data if isinstance(data, ProfileScan) else ProfileScan(data, len(names), pairwise=False)
+    points = scan.dowdall_scores()                              # 1, 1/2, 1/3... points based on ranking
+
+    return([x[1] for x in sorted(((value, index) for index, value in enumerate(points)), reverse=True)])
+
+def k_approval(data, names, k):
+
+    scan = data if isinstance(data, ProfileScan) else ProfileScan(data, len(names), pairwise=False)
+    points = scan.k_approval_scores(k)                          # a point for each of the first k levels
+
+    return([x[1] for x in sorted(((value, index) for index, value in enumerate(points)), reverse=True)])
+
+def veto(data, names):
+
+    scan = data if isinstance(data, ProfileScan) else ProfileScan(data, len(names), pairwise=False)
+    points = scan.veto_scores()                                 # a point for everyone but the last
+
+    return([x[1] for x in sorted(((value, index) for index, value in enumerate(points)), reverse=True)])
+
+def pairwise_of(data, names):
+    """
+    Pairwise majority matrix of a profile, a ProfileScan hands out the one it already counted
+    """
+    if isinstance(data, ProfileScan):
+        return data.pairwise_counts()
+    return pairwise_matrix(data, len(names))
+
+def copeland(data,names,pairwise=None):
 
-    score = [0] * len(names) # start with empty list
+    if isinstance(data, ProfileScan) and pairwise is None:
+        score = data.copeland_scores()
+        return([x[1] for x in sorted(((value, index) for index, value in enumerate(score)), reverse=True)])
 
-    for ballot in data: 
-        for idx, vote in enumerate(ballot): 
-            score[vote] += len(names) - 1 - 2*idx  # increase score by how many they're above vs how many are ranked higher
-        for i in names:
-            if i not in ballot:
-                score[i] -= len(ballot)       # un voted for is tied bottom, subtract number above from score
+    if pairwise is None:
+        pairwise = pairwise_of(data, names)
+    # how many times they're ranked above vs below the others, un voted for is tied bottom
+    score = margins(pairwise).sum(axis=1).tolist()
 
     return([x[1] for x in sorted(((value, index) for index, value in enumerate(score)), reverse=True)])
 
-def equalshares(projects):
-
-    scores = []
-    winners = []
-    for idx in range(len(projects)):
-        scores.append(projects[idx].cost/len(projects[idx].supporters))
-    choice = scores.index(min(scores))
-    while scores[choice] < 100000:
-        if projects[choice].is_affordable():
-            projects[choice].pick_in_equal_shares()
-            winners.append(choice)
-        scores[choice] = 100000
-        choice = scores.index(min(scores))
-    
-    return winners
\ No newline at end of file
+def schulze(data,names,pairwise=None):
+
+    if pairwise is None:
+        pairwise = pairwise_of(data, names)
+    paths = strongest_paths(pairwise)
+    score = (paths > paths.T).sum(axis=1).tolist()             # number of candidates beaten by a stronger path
+
+    return([x[1] for x in sorted(((value, index) for index, value in enumerate(score)), reverse=True)])
+
+def ranked_pairs(data,names,pairwise=None):
+
+    if pairwise is None:
+        pairwise = pairwise_of(data, names)
+    score = [len(below) for below in ranked_pairs_graph(pairwise)] # number of candidates locked below
+
+    return([x[1] for x in sorted(((value, index) for index, value in enumerate(score)), reverse=True)])
+
+def minimax(data,names,pairwise=None):
+
+    if pairwise is None:
+        pairwise = pairwise_of(data, names)
+    score = (-margins(pairwise).max(axis=0)).tolist()          # minus the margin of the worst pairwise defeat
+
+    return([x[1] for x in sorted(((value, index) for index, value in enumerate(score)), reverse=True)])
+
+def equalshares(election, completion=None):
+    """
+    Method of Equal Shares, every voter starts with their share of the budget
+    input:
+        election: Election (projects with their supporters, voter budgets)
+        completion: None, "add1" or "epsilon" (see equal_shares_completed)
+    output:
+        winners: list of ints (projects in the order they were bought)
+    """
+    costs = [project.cost for project in election.projects]
+    supporters = [project.supporters for project in election.projects]
+    budgets = election.population.budget
+    if completion is None:
+        return equal_shares(costs, supporters, budgets)[0]
+    return equal_shares_completed(costs, supporters, budgets, election.budget, completion)
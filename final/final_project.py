@@ -1,87 +1,150 @@
 import random
 from enum import Enum
+from multiprocessing import Pool
+from os import cpu_count
+import numpy as np
+import common_path
+from ballot_matrix import BallotMatrix
+from budgeting import allocate
 from finalSCFs import *
 from welfares import *
-from numpy import std, mean
-
-random.seed(1)
+import tracing
 
 class BallotType(Enum):
     APPROVAL = 1
     FULL_RANKING = 2
     PARTIAL_RANKING = 3
 
-# Class representing a neighborhood
+# Class representing one simulated election, it owns everything created for it
+# so several elections can exist side by side in one process
+class Election:
+    def __init__(self, budget, seed=None) -> None:
+        self.budget = budget
+        self.random = random.Random(seed) if seed is not None else random  # Unseeded elections share the global generator
+        self.rng = np.random.default_rng(self.random.getrandbits(64))     # Bulk draws, seeded from the generator above
+        self.neighborhoods = []
+        self.population = Population()
+        self.projects = []
+
+    def add_neighborhood(self, nr_inhabitants, preferences, cohesion):
+        neighborhood = Neighborhood(self, nr_inhabitants, preferences, cohesion)
+        self.neighborhoods.append(neighborhood)
+        return neighborhood
+
+    def add_project(self, attributes, neighborhoods, cost):
+        project = Project(self, attributes, neighborhoods, cost)
+        self.projects.append(project)
+        return project
+
+
+# Class representing a neighborhood, its inhabitants are drawn all at once
 class Neighborhood:
-    def __init__(self, nr_inhabitants, preferences, cohesion) -> None:
+    def __init__(self, election, nr_inhabitants, preferences, cohesion) -> None:
+        self.election = election
+        self.id = len(election.neighborhoods)
         self.preferences = preferences
         self.cohesion = cohesion
-        self.inhabitants = [Person(self) for i in range(nr_inhabitants)]
+        attributes = election.rng.normal(preferences, cohesion, size=(nr_inhabitants, 4))
+        self.inhabitants = election.population.add(self.id, attributes)
         self.nr_inhabitants = nr_inhabitants
 
 
-# Class representing a person with a political preference based on 4 attributes
-class Person:
-    INSTANCES = []
-    NR_INSTANCES = 0
-    def __init__(self, neighborhood) -> None:
-        self.neighborhood = neighborhood
-        self.attributes = {i: random.gauss(neighborhood.preferences[i], neighborhood.cohesion) for i in range(4)}
-        self.required_approval = 0
-        self.project_approvals = {}
-        self.approves = []
-        self.rankings = []
-        self.budget = 0
-        Person.INSTANCES.append(self)
-        Person.NR_INSTANCES += 1
+# Class representing every person of an election, one row per person with a
+# political preference based on 4 attributes
+class Population:
+    def __init__(self) -> None:
+        self.attributes = np.empty((0, 4))
+        self.neighborhood = np.empty(0, dtype=np.int32)
+        self.budget = np.empty(0)
+        # Filled in by project_approval, one column per project
+        self.required_approval = None
+        self.approval_scores = None                             # raw score of every project
+        self.satisfaction = None                                # scores clipped to [0, 1]
+        self.approves = None                                    # bool mask of approved projects
+        self.rankings = None                                    # projects sorted by score, best first
+        self.nr_approved = None
+
+    def __len__(self):
+        return len(self.neighborhood)
+
+    def add(self, neighborhood_id, attributes):
+        """
+        Add the inhabitants of a neighborhood
+        output:
+            inhabitants: range of ints (rows of the new persons)
+        """
+        start = len(self)
+        self.attributes = np.concatenate([self.attributes, attributes])
+        self.neighborhood = np.concatenate([self.neighborhood, np.full(len(attributes), neighborhood_id, dtype=np.int32)])
+        self.budget = np.concatenate([self.budget, np.zeros(len(attributes))])
+        return range(start, len(self))
 
     def project_approval(self, projects):
+        """
+        Score every project for every person at once, approve the projects above
+        each person's required approval and rank all projects by score
+        input:
+            projects: list of Projects (project.instance is its column)
+        """
+        project_attributes = np.array([project.attributes for project in projects])
+        # Same summation order as the scalar dot product, so scores are bit-identical to it
+        scores = np.zeros((len(self), len(projects)))
+        for i in range(4):
+            scores += self.attributes[:, i:i + 1] * project_attributes[:, i]
+
+        # Projects outside a person's neighborhood count half
+        local = np.zeros((self.neighborhood.max(initial=-1) + 1, len(projects)), dtype=bool)
         for project in projects:
-            approval = sum([self.attributes[i] * project.attributes[i] for i in range(4)])
-            if self.neighborhood not in project.neighborhoods:
-                approval *= 0.5
-            
-            if approval > self.required_approval:
-                project.add_supporter(self)
-                self.approves.append(project.instance)
-            
-            self.project_approvals[project] = approval
-        if len(self.approves) == 0:
-            self.required_approval -= 0.1
-            self.project_approval(projects)
-            return
+            local[project.neighborhood_ids, project.instance] = True
+        scores = np.where(local[self.neighborhood], scores, scores * 0.5)
 
-        # Sort the projects by approval
-        self.rankings = sorted(self.project_approvals.items(), key=lambda x: x[1], reverse=True)
-        self.rankings = [x.instance for x, _ in self.rankings]
-        for k, v in self.project_approvals.items():
-            self.project_approvals[k] = max(0, min(1, v))
+        # A person approving nothing lowers their required approval in steps of 0.1
+        # until something passes, find that step directly from their best score
+        best = scores.max(axis=1, initial=-np.inf)
+        thresholds = [0]
+        while len(best) > 0 and thresholds[-1] >= best.min():
+            thresholds.append(thresholds[-1] - 0.1)
+        thresholds = np.array(thresholds)
+        self.required_approval = thresholds[np.searchsorted(-thresholds, -best, side="right")]
 
-    
-    def get_ballot(self, ballot_type: BallotType):
+        self.approval_scores = scores
+        self.approves = scores > self.required_approval[:, None]
+        for project in projects:
+            project.supporters = np.flatnonzero(self.approves[:, project.instance]).tolist()
+
+        # Sort the projects by approval, approved projects always form a prefix
+        self.rankings = np.argsort(-scores, axis=1, kind="stable").astype(np.int32)
+        self.nr_approved = self.approves.sum(axis=1)
+        self.satisfaction = np.clip(scores, 0, 1)
+
+    def ballots(self, ballot_type: BallotType):
+        """
+        Ballots of every person as a BallotMatrix built on the population's arrays
+        """
+        nr_projects = self.approves.shape[1]
+        columns = np.broadcast_to(np.arange(nr_projects, dtype=np.int32), self.approves.shape)
+        weights = np.ones(len(self), dtype=np.int64)
         if ballot_type == BallotType.APPROVAL:
-            return self.approves
+            ranks = np.where(self.approves, columns, -1)
+            levels = np.where(self.approves, np.cumsum(self.approves, axis=1) - 1, -1)
         elif ballot_type == BallotType.FULL_RANKING:
-            return self.rankings
+            ranks = self.rankings
+            levels = columns
         elif ballot_type == BallotType.PARTIAL_RANKING:
-            return [x for x in self.rankings if x in self.approves]
-    
-    @staticmethod
-    def reset():
-        Person.INSTANCES = []
-        Person.NR_INSTANCES = 0
+            approved = columns < self.nr_approved[:, None]
+            ranks = np.where(approved, self.rankings, -1)
+            levels = np.where(approved, columns, -1)
+        return BallotMatrix(ranks, levels, weights, nr_projects)
 
  
 # Class representing a project
 class Project:
-    INSTANCES = []
-    NR_INSTANCES = 0
-    def __init__(self, attributes, neighborhoods, cost) -> None:
-        self.instance = Project.NR_INSTANCES
-        Project.INSTANCES.append(self)
-        Project.NR_INSTANCES += 1
+    def __init__(self, election, attributes, neighborhoods, cost) -> None:
+        self.election = election
+        self.instance = len(election.projects)
         self.attributes = attributes
         self.neighborhoods = neighborhoods
+        self.neighborhood_ids = [n.id for n in neighborhoods]
         self.cost = cost
         self.supporters = []
 
@@ -90,73 +153,40 @@ class Project:
 
     def __str__(self) -> str:
         return self.instance
-    
-    def is_affordable(self) -> bool:
-        return sum([x.budget for x in self.supporters]) >= self.cost
-
-    def pick_in_equal_shares(self):
-        budget_per_person = self.cost / len(self.supporters)
-        min_budget = min([x.budget for x in self.supporters])
-        while min_budget < budget_per_person:
-            self.cost -= len(self.supporters) * min_budget
-            for person in self.supporters:
-                person.budget -= min_budget
-                if person.budget <= 0:
-                    self.supporters.remove(person)
-            min_budget = min([x.budget for x in self.supporters])
-            budget_per_person = self.cost / len(self.supporters)
-
-
-    @staticmethod
-    def reset():
-        Project.INSTANCES = []
-        Project.NR_INSTANCES = 0
-
-def applyBudgetMaximally(outputSCF,budget):
-    affordable_projects = []
-    for project in outputSCF:
-        if ((budget - Project.INSTANCES[project].cost) < 0):
-            continue
-        budget -= Project.INSTANCES[project].cost
-        affordable_projects.append(project)
-    return affordable_projects
-
-def single_simulation():
-    welfares = {
-        "utalitarian": 0,
-        "chamberlin": 0,
-        "egalitarian": 0,
-        "nash": 0 
-    }
-    results = {
-        "plurality": welfares.copy(),
-        "stv": welfares.copy(),
-        "approval": welfares.copy(),
-        "condorcet": welfares.copy(),
-        "borda": welfares.copy(),
-        "copeland": welfares.copy(),
-        "equalshares": welfares.copy()
-    }
-    budget = 25000
-    nr_projects = 20
+
+
+def applyBudgetMaximally(election,outputSCF,method="rank"):
+    costs = [project.cost for project in election.projects]
+    return allocate(costs, outputSCF, election.budget, method)
+
+NEIGHBORHOODS = [                                               # (inhabitants, preferences, cohesion)
+    (200, [0.4, 0.2, 0.1, -0.1], 0.1),
+    (800, [0.2, -0.3, 0.2, 0.2], 0.5),
+    (400, [-0.6, 0.4, 0.3, -0.4], 0.2),
+    (400, [-0.2, 0.4, 0.2, -0.3], 0.3),
+    (700, [0.1, -0.1, 0.1, 0.2], 0.4)
+]
+
+def build_election(seed=None, nr_voters=2500, nr_projects=20, budget=25000):
+    """
+    Election of the simulation with every person's approval of every project worked out,
+    neighborhoods keep their share of the population for any nr_voters
+    """
+    election = Election(budget, seed)
     # Create 5 neighborhoods
-    neighborhoods = []
-    neighborhoods.append(Neighborhood(200, [0.4, 0.2, 0.1, -0.1], 0.1))
-    neighborhoods.append(Neighborhood(800, [0.2, -0.3, 0.2, 0.2], 0.5))
-    neighborhoods.append(Neighborhood(400, [-0.6, 0.4, 0.3, -0.4], 0.2))
-    neighborhoods.append(Neighborhood(400, [-0.2, 0.4, 0.2, -0.3], 0.3))
-    neighborhoods.append(Neighborhood(700, [0.1, -0.1, 0.1, 0.2], 0.4))
-    nr_neighborhoods = len(neighborhoods)
-    for person in Person.INSTANCES:
-        person.budget = budget / Person.NR_INSTANCES
+    with tracing.span("population", "simulation", voters=nr_voters):
+        total = sum(size for size, _, _ in NEIGHBORHOODS)
+        for size, preferences, cohesion in NEIGHBORHOODS:
+            election.add_neighborhood(round(size * nr_voters / total), preferences, cohesion)
+        neighborhoods = election.neighborhoods
+        election.population.budget[:] = budget / len(election.population)
 
     # Create projects
-    projects = []
     size_probabilities = [0.4, 0.2, 0.05, 0.05, 0.3]
     possible_costs = [200, 500, 1000, 1500, 2000, 5000, 8000, 10000, None]
     for i in range(nr_projects):
         # Pick a random number of neighborhoods to support the project
-        project_size = random.random()
+        project_size = election.random.random()
         for n, j in enumerate(size_probabilities):
             project_size -= j
             if project_size < 0:
@@ -165,72 +195,136 @@ def single_simulation():
         in_neighborhoods = []
         for _ in range(project_size):
             # Pick a random neighborhood to support the project
-            neighborhood = random.choice(neighborhoods)
+            neighborhood = election.random.choice(neighborhoods)
             if neighborhood not in in_neighborhoods:
                 in_neighborhoods.append(neighborhood)
 
         # Create the project
         current_possible_costs = possible_costs[project_size-1: -6 + project_size]
-        project = Project([random.uniform(-1, 1) for _ in range(4)], neighborhoods, random.choice(current_possible_costs))
-        projects.append(project)
+        election.add_project([election.random.uniform(-1, 1) for _ in range(4)], neighborhoods, election.random.choice(current_possible_costs))
 
     # Have each person project their approval for each project
-    for person in Person.INSTANCES:
-        person.project_approval(projects)
-
-    partial_approval_profile = [x.get_ballot(BallotType.PARTIAL_RANKING) for x in Person.INSTANCES]
-    full_approval_profile = [x.get_ballot(BallotType.FULL_RANKING) for x in Person.INSTANCES]
-
-    choices = {
-        "plurality": applyBudgetMaximally(plurality(partial_approval_profile.copy(),list(range(0,nr_projects)),standalone=True),budget),
-        "stv": applyBudgetMaximally(STV(full_approval_profile.copy(), list(range(0,nr_projects)), eliminations=[]),budget),
-        "approval": applyBudgetMaximally(approval(partial_approval_profile.copy(), list(range(0,nr_projects))),budget),
-        "condorcet": applyBudgetMaximally(condorcet(partial_approval_profile.copy(), list(range(0,nr_projects))),budget),
-        "borda": applyBudgetMaximally(borda(partial_approval_profile.copy(), list(range(0,nr_projects))),budget),
-        "copeland": applyBudgetMaximally(copeland(partial_approval_profile.copy(), list(range(0,nr_projects))),budget),
-        "equalshares": applyBudgetMaximally(equalshares(Project.INSTANCES),budget)
-    }
-
-    for key, value in choices.items():
-        projects = [Project.INSTANCES[x] for x in value]
-        results[key]["utalitarian"] = utalitarian_welfare(Person.INSTANCES, choices[key])
-        results[key]["chamberlin"] = chamberlin_courant_welfare(Person.INSTANCES, choices[key])
-        results[key]["egalitarian"] = egalitarian_social_welfare(Person.INSTANCES, choices[key])
-        results[key]["nash"] = nash_welfare(Person.INSTANCES, choices[key])
-    return results
+    with tracing.span("project_approval", "simulation", voters=len(election.population), projects=nr_projects):
+        election.population.project_approval(election.projects)
+    return election
+
+def single_simulation(seed=None, allocation="rank"):
+    with tracing.span("simulation", "simulation", seed=str(seed)):
+        election = build_election(seed)
+        nr_projects = len(election.projects)
+
+        partial_approval_profile = election.population.ballots(BallotType.PARTIAL_RANKING)
+        full_approval_profile = election.population.ballots(BallotType.FULL_RANKING)
+        with tracing.span("scf.scan", "simulation"):
+            partial_scan = ProfileScan(partial_approval_profile, nr_projects)     # One pass feeds every score based rule
+
+        rules = {
+            "plurality": lambda: plurality(partial_scan,list(range(0,nr_projects)),standalone=True),
+            "stv": lambda: STV(full_approval_profile, list(range(0,nr_projects)), eliminations=[]),
+            "approval": lambda: approval(partial_scan, list(range(0,nr_projects))),
+            "condorcet": lambda: condorcet(partial_scan, list(range(0,nr_projects))),
+            "borda": lambda: borda(partial_scan, list(range(0,nr_projects))),
+            "copeland": lambda: copeland(partial_scan, list(range(0,nr_projects))),
+            "equalshares": lambda: equalshares(election)
+        }
+        choices = {}
+        for name, rule in rules.items():
+            with tracing.span(f"scf.{name}", "simulation"):
+                outcome = rule()
+            with tracing.span(f"applyBudgetMaximally.{name}", "simulation", method=allocation):
+                choices[name] = applyBudgetMaximally(election,outcome,allocation)
+
+        results = WelfareEvaluator(election).evaluate(choices)
+        return results
        
 
 def copy_dict(dic):
     return {k: v.copy() for k,v in dic.items()}
 
 
-if __name__=="__main__":
-    welfares = {
-        "utalitarian": [],
-        "chamberlin": [],
-        "egalitarian": [],
-        "nash": [] 
-    }
-    results = {
-        "plurality": copy_dict(welfares.copy()),
-        "stv": copy_dict(welfares.copy()),
-        "approval": copy_dict(welfares.copy()),
-        "condorcet": copy_dict(welfares.copy()),
-        "borda": copy_dict(welfares.copy()),
-        "copeland": copy_dict(welfares.copy()),
-        "equalshares": copy_dict(welfares.copy())
-    }
+# Running mean and variance (Welford), partial results can be merged (Chan et al.)
+class RunningStats:
+    def __init__(self) -> None:
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
 
-    nr_simulations = 1000
-    for i in range(nr_simulations):
-        print(f"Simulation {i+1}/{nr_simulations}", end="\r")
-        Person.reset()
-        Project.reset()
-        result = single_simulation()
+    def add(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+
+    def merge(self, other):
+        if other.count == 0:
+            return
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.m2 += other.m2 + delta * delta * self.count * other.count / count
+        self.count = count
+
+    def std(self):
+        return (self.m2 / self.count) ** 0.5 if self.count > 0 else 0.0
+
+
+def simulate_chunk(args):
+    """
+    Run a block of simulations, every simulation is seeded from (seed, its index)
+    so its outcome does not depend on which worker runs it
+    input:
+        args: tuple of (seed, first simulation index, last simulation index + 1)
+    output:
+        stats: dict of dicts of RunningStats (rule -> welfare -> stats over the block)
+    """
+    seed, start, stop = args
+    stats = {}
+    for i in range(start, stop):
+        result = single_simulation(f"{seed}-{i}")
         for key, value in result.items():
             for key2, value2 in value.items():
-                results[key][key2].append(value2)
+                stats.setdefault(key, {}).setdefault(key2, RunningStats()).add(value2)
+    return stats
+
+
+def run_simulations(nr_simulations, seed=1, workers=None, chunk_size=50, trace=None):
+    """
+    Run independent simulations on a process pool
+    input:
+        nr_simulations: int
+        seed: int (the same seed and chunk_size give bit-identical results for any number of workers)
+        workers: int (number of processes, None for all cores, 1 runs in this process)
+        chunk_size: int (simulations per task sent to a worker)
+        trace: string (trace file of every stage, see tracing.enable), None records nothing
+    output:
+        stats: dict of dicts of RunningStats (rule -> welfare -> stats over all simulations)
+    """
+    chunks = [(seed, start, min(start + chunk_size, nr_simulations)) for start in range(0, nr_simulations, chunk_size)]
+    workers = workers or cpu_count()
+    stats = {}
+    done = 0
+
+    if trace is not None:
+        tracing.enable(trace)
+    pool = Pool(workers, tracing.enable if trace else None, (trace,) if trace else ()) if workers > 1 else None
+    partials = pool.imap(simulate_chunk, chunks) if pool else map(simulate_chunk, chunks)
+    for (_, start, stop), partial in zip(chunks, partials):  # imap keeps chunk order, so merging is deterministic
+        for key, value in partial.items():
+            for key2, value2 in value.items():
+                stats.setdefault(key, {}).setdefault(key2, RunningStats()).merge(value2)
+        done += stop - start
+        print(f"Simulation {done}/{nr_simulations}", end="\r")
+    if pool:
+        pool.close()
+        pool.join()
+    print()
+    return stats
+
+
+if __name__=="__main__":
+    nr_simulations = 1000
+    results = run_simulations(nr_simulations, seed=1)
     
     for key, value in results.items():
         for key2, value2 in value.items():
-            print(f"{key} {key2}\t Mean:{mean(value2)}, std:{std(value2)}")
\ No newline at end of file
+            print(f"{key} {key2}\t Mean:{value2.mean}, std:{value2.std()}")
@@ -0,0 +1,100 @@
+import heapq
+import numpy as np
+
+
+def affordability(budgets, cost):
+    """
+    Smallest rho such that supporters paying min(budget, rho) each cover the cost
+    input:
+        budgets: float array (current budgets of the project's supporters)
+        cost: float (cost of the project)
+    output:
+        rho: float, or None if the supporters cannot afford the project
+    """
+    if cost <= 0:
+        return 0.0
+    if len(budgets) == 0:
+        return None
+    ordered = np.sort(budgets)
+    paid = np.cumsum(ordered)
+    paid_before = paid - ordered                                # paid in full by the poorer supporters
+    remaining = np.arange(len(ordered), 0, -1)                  # supporters paying rho
+    enough = paid_before + ordered * remaining >= cost
+    if not enough[-1]:
+        return None
+    j = int(np.argmax(enough))
+    return (cost - paid_before[j]) / remaining[j]
+
+
+def equal_shares(costs, supporters, budgets):
+    """
+    Method of Equal Shares for approval ballots.
+    Repeatedly buys the project whose supporters can pay for it with the
+    lowest maximal payment rho, every supporter paying min(budget, rho).
+    Budgets only go down, so a project's rho only goes up: the heap keeps
+    possibly outdated rhos as lower bounds and only recomputes the top.
+    input:
+        costs: list of floats (cost of each project)
+        supporters: list of int arrays or lists (voters approving each project)
+        budgets: float array (starting budget of every voter), not modified
+    output:
+        winners: list of ints (projects in the order they were bought)
+        budgets: float array (budget every voter has left)
+    """
+    budgets = np.array(budgets, dtype=float)
+    supporters = [np.asarray(voters, dtype=np.int64) for voters in supporters]
+    heap = []
+    for project, cost in enumerate(costs):
+        rho = affordability(budgets[supporters[project]], cost)
+        if rho is not None:
+            heap.append((rho, project))
+    heapq.heapify(heap)
+
+    winners = []
+    while len(heap) > 0:
+        rho, project = heapq.heappop(heap)
+        voters = supporters[project]
+        current = affordability(budgets[voters], costs[project])
+        if current is None:
+            continue                                            # Can never become affordable again
+        if current > rho:
+            heapq.heappush(heap, (current, project))            # Outdated, put back with its real rho
+            continue
+        budgets[voters] -= np.minimum(budgets[voters], current)
+        winners.append(project)
+    return winners, budgets
+
+
+def equal_shares_completed(costs, supporters, budgets, limit, completion="add1", increment=1.0, epsilon=0.01):
+    """
+    Method of Equal Shares with a completion step: rerun it with ever larger
+    virtual voter budgets and keep the last outcome that still fits the real budget
+    input:
+        costs, supporters, budgets: see equal_shares
+        limit: float (real total budget)
+        completion: "add1" (every voter gets increment more per step) or
+                    "epsilon" (every budget grows by a factor 1 + epsilon per step)
+    output:
+        winners: list of ints (projects in the order they were bought)
+    """
+    budgets = np.asarray(budgets, dtype=float)
+    winners, _ = equal_shares(costs, supporters, budgets)
+    if completion == "epsilon":
+        # Budgets only grow in proportion, so a project whose supporters all have no budget stays out of reach
+        nr_supported = sum(1 for voters in supporters if any(budgets[voter] > 0 for voter in voters))
+    else:
+        nr_supported = sum(1 for voters in supporters if len(voters) > 0)
+    step = 0
+    while len(winners) < nr_supported:
+        step += 1
+        if completion == "add1":
+            virtual = budgets + step * increment
+        elif completion == "epsilon":
+            virtual = budgets * (1 + epsilon) ** step
+        else:
+            raise ValueError(f"Unknown completion {completion}")
+        result, _ = equal_shares(costs, supporters, virtual)
+        if sum(costs[project] for project in result) > limit:
+            break
+        winners = result
+    return winners
@@ -0,0 +1,72 @@
+import numpy as np
+import common_path
+from ballot_matrix import BallotMatrix
+from pairwise import matrix_pairwise, margins
+
+
+class ProfileScan:
+    """
+    Everything the score based rules need from a profile, gathered in one pass.
+    positions[c, k] is the number of voters listing candidate c at level k, so
+    every positional scoring rule (Borda, Dowdall, k-approval, veto, approval)
+    is one product of positions with a score per level. first holds the exact
+    first preferences (tie groups split, in units of 1/scale as BallotMatrix
+    counts them) and pairwise the pairwise majority counts of the Condorcet rules.
+    The rules of finalSCFs accept a ProfileScan wherever they accept a BallotMatrix.
+    """
+    def __init__(self, data, nr_candidates=None, pairwise=True) -> None:
+        if not isinstance(data, BallotMatrix):
+            data = BallotMatrix.from_ballots(list(data), None, nr_candidates)
+        self.matrix = data
+        self.nr_candidates = m = data.nr_candidates
+        self.width = max(m, data.ranks.shape[1])
+        listed = data.ranks >= 0
+        weights = np.broadcast_to(data.weights[:, None], data.ranks.shape)
+
+        entries = data.ranks[listed].astype(np.int64) * self.width + data.levels[listed]
+        totals = np.bincount(entries, weights=weights[listed], minlength=m * self.width)
+        self.positions = np.rint(totals).astype(np.int64).reshape(m, self.width)
+
+        first = listed & (data.levels == 0)                     # Levels start at 0 on every non-empty ballot
+        share = data.weights * data.scale // np.maximum(first.sum(axis=1), 1)
+        self.first = data.count(first, np.broadcast_to(share[:, None], data.ranks.shape))
+
+        self.pairwise = matrix_pairwise(data) if pairwise else None
+
+    def pairwise_counts(self):
+        """
+        Pairwise majority matrix, computed now if the scan was made without it
+        """
+        if self.pairwise is None:
+            self.pairwise = matrix_pairwise(self.matrix)
+        return self.pairwise
+
+    def positional_scores(self, points):
+        """
+        Total points of each candidate, points[k] for every voter listing it at level k
+        (levels past the end of points score 0)
+        """
+        points = np.asarray(points)[:self.width]
+        return (self.positions[:, :len(points)] @ points).tolist()
+
+    def first_preferences(self):
+        return self.matrix.to_votes(self.first)
+
+    def approval_scores(self):
+        return self.positions.sum(axis=1).tolist()
+
+    def borda_scores(self):
+        return self.positional_scores(self.nr_candidates - 1 - np.arange(self.nr_candidates))
+
+    def dowdall_scores(self):
+        return self.positional_scores(1 / np.arange(1, self.nr_candidates + 1))
+
+    def k_approval_scores(self, k):
+        return self.positional_scores(np.ones(k, dtype=np.int64))
+
+    def veto_scores(self):
+        # Approving everyone but the last of the m candidates, unlisted candidates count as last
+        return self.k_approval_scores(self.nr_candidates - 1)
+
+    def copeland_scores(self):
+        return margins(self.pairwise_counts()).sum(axis=1).tolist()
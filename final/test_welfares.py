@@ -0,0 +1,20 @@
+from types import SimpleNamespace
+import numpy as np
+from welfares import WelfareEvaluator
+
+
+def small_election():
+    # Voters 0 and 1 approve project 0, half of the voters can afford it together
+    approves = np.array([[True, False], [True, False], [False, True], [False, False]])
+    population = SimpleNamespace(approves=approves, satisfaction=approves.astype(float))
+    projects = [SimpleNamespace(cost=10), SimpleNamespace(cost=30)]
+    return SimpleNamespace(population=population, projects=projects, budget=20)
+
+
+def test_empty_outcome_violates_ejr():
+    results = WelfareEvaluator(small_election()).evaluate({"empty": [], "fair": [0]}, ["ejr", "proportionality", "utalitarian"])
+    assert results["empty"]["ejr"] == 1
+    assert results["empty"]["proportionality"] == 0
+    assert results["empty"]["utalitarian"] == 0
+    assert results["fair"]["ejr"] == 0
+    assert results["fair"]["proportionality"] == 1
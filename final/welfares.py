@@ -1,42 +1,209 @@
-
 """
 This module contains the functions for calculating the different welfare functions.
 """
+from itertools import combinations
+from math import ceil, exp
+import numpy as np
+import common_path
+import tracing
+
+WELFARES = ["utalitarian", "chamberlin", "egalitarian", "nash", "log_nash"]
+
+
+class LogNash:
+    """
+    Nash welfare as a sum of logs, accumulated over chunks of voters.
+    Every voter contributes log(max(min(1, satisfaction), epsilon)), so the
+    value never underflows, and voters at or below epsilon are counted
+    instead of silently turning the whole product into 0.
+    Accumulators of different shards of a population can be merged.
+    """
+    def __init__(self, epsilon=1e-9) -> None:
+        self.epsilon = epsilon
+        self.log_sum = 0.0
+        self.count = 0
+        self.zeros = 0
+
+    def add(self, satisfaction):
+        """
+        Add the satisfaction of a chunk of voters
+        input:
+            satisfaction: float array (total satisfaction of each voter)
+        """
+        capped = np.minimum(1, np.asarray(satisfaction, dtype=float))
+        self.zeros += int((capped <= self.epsilon).sum())
+        self.log_sum += float(np.log(np.maximum(capped, self.epsilon)).sum())
+        self.count += len(capped)
+        return self
+
+    def merge(self, other):
+        if other.epsilon != self.epsilon:
+            raise ValueError("Cannot merge Nash welfares with different epsilons")
+        self.log_sum += other.log_sum
+        self.count += other.count
+        self.zeros += other.zeros
+        return self
+
+    def mean(self):
+        """Mean log satisfaction per voter (log of the geometric mean)"""
+        return self.log_sum / self.count if self.count > 0 else 0.0
+
+    def product(self):
+        """Plain Nash welfare, only meaningful for small populations"""
+        return exp(self.log_sum)
+
+    def report(self):
+        return {
+            "log_sum": self.log_sum,
+            "mean_log": self.mean(),
+            "geometric_mean": exp(self.mean()),
+            "voters": self.count,
+            "zeros": self.zeros,
+            "epsilon": self.epsilon
+        }
+
+
+class WelfareEvaluator:
+    """
+    Evaluates the welfare of any number of outcomes of one election.
+    Every outcome becomes a row of a selection mask, so the per-voter
+    satisfaction of all outcomes comes out of one product with the
+    person x project satisfaction matrix and every welfare is derived
+    from those per-voter aggregates.
+    """
+    def __init__(self, election, epsilon=1e-9) -> None:
+        self.epsilon = epsilon
+        self.satisfaction = election.population.satisfaction
+        self.approves = election.population.approves
+        self.costs = np.array([project.cost for project in election.projects], dtype=float)
+        self.budget = election.budget
+
+    def selection(self, outcomes):
+        selected = np.zeros((len(outcomes), self.satisfaction.shape[1]), dtype=bool)
+        for row, projects in enumerate(outcomes):
+            selected[row, list(projects)] = True
+        return selected
 
-def utalitarian_welfare(persons, projects):
+    def evaluate(self, outcomes, welfares=WELFARES):
+        """
+        Welfare of every outcome
+        input:
+            outcomes: dict of names to lists of ints (selected projects of each rule)
+            welfares: list of strings (WELFARES, "proportionality" and/or "ejr"),
+                      "log_nash" is the mean log satisfaction, see LogNash
+        output:
+            results: dict of names to dicts of welfare names to floats
+        """
+        names = list(outcomes)
+        with tracing.span("welfare.satisfaction", "simulation", outcomes=len(names)):
+            selected = self.selection([outcomes[name] for name in names])
+            sums = self.satisfaction @ selected.T.astype(float) # person x outcome total satisfaction
+            approved = self.approves.astype(np.int64) @ selected.T.astype(np.int64)
+
+        results = {name: {} for name in names}
+        for welfare in welfares:
+            with tracing.span(f"welfare.{welfare}", "simulation", outcomes=len(names)):
+                for row, name in enumerate(names):
+                    nr_selected = int(selected[row].sum())
+                    if welfare == "log_nash":                   # Defined for empty outcomes too
+                        results[name][welfare] = LogNash(self.epsilon).add(sums[:, row]).mean()
+                    elif welfare == "proportionality":          # An empty outcome still owes the cohesive groups
+                        results[name][welfare] = self.proportionality_degree(approved[:, row])
+                    elif welfare == "ejr":
+                        results[name][welfare] = len(self.ejr_violations(selected[row], approved[:, row]))
+                    elif nr_selected == 0:
+                        results[name][welfare] = 0
+                    elif welfare == "utalitarian":
+                        results[name][welfare] = sums[:, row].sum() / (len(sums) * nr_selected)
+                    elif welfare == "chamberlin":
+                        results[name][welfare] = self.satisfaction[:, selected[row]].max(axis=1).mean()
+                    elif welfare == "egalitarian":
+                        results[name][welfare] = sums[:, row].min()
+                    elif welfare == "nash":
+                        results[name][welfare] = np.prod(np.minimum(1, sums[:, row]))
+                    else:
+                        raise ValueError(f"Unknown welfare {welfare}")
+        return results
+
+    def nash(self, outcomes, chunk_size=1 << 16):
+        """
+        Log-space Nash welfare of every outcome, streamed over chunks of voters
+        output:
+            nash: dict of names to LogNash
+        """
+        names = list(outcomes)
+        selected = self.selection([outcomes[name] for name in names]).T.astype(float)
+        nash = {name: LogNash(self.epsilon) for name in names}
+        for start in range(0, len(self.satisfaction), chunk_size):
+            sums = self.satisfaction[start:start + chunk_size] @ selected
+            for row, name in enumerate(names):
+                nash[name].add(sums[:, row])
+        return nash
+
+    def cohesive_groups(self, max_size=2):
+        """
+        Voters approving every project of T, for every T of at most max_size
+        projects whose supporters can afford it with their share of the budget
+        output:
+            iterator of (T, voters, required) tuples, required is the minimal
+            number of voters of a T-cohesive group
+        """
+        n, m = self.approves.shape
+        for size in range(1, max_size + 1):
+            for projects in combinations(range(m), size):
+                voters = np.flatnonzero(self.approves[:, list(projects)].all(axis=1))
+                required = ceil(self.costs[list(projects)].sum() * n / self.budget - 1e-9)
+                if required <= len(voters):
+                    yield projects, voters, max(required, 1)
+
+    def ejr_violations(self, selected, approved, max_size=2):
+        """
+        Cohesive groups that violate EJR up to one (approval satisfaction, PB version):
+        enough voters of the group have fewer than |T| approved winners, and no project
+        of T they could still be given would lift them above |T|
+        input:
+            selected: bool array (selected projects)
+            approved: int array (number of approved selected projects per voter)
+        output:
+            violations: list of tuples of ints (the project sets T)
+        """
+        violations = []
+        for projects, voters, required in self.cohesive_groups(max_size):
+            if all(selected[list(projects)]):
+                continue                                        # every voter of the group gets |T|
+            unsatisfied = approved[voters] + 1 <= len(projects)  # even one more project keeps them at <= |T|
+            if unsatisfied.sum() >= required:
+                violations.append(projects)
+        return violations
+
+    def proportionality_degree(self, approved, max_size=2):
+        """
+        Worst average satisfaction of a cohesive group relative to its |T|, over
+        every T of at most max_size projects (1 means every group gets its due)
+        """
+        degree = 1.0
+        for projects, voters, required in self.cohesive_groups(max_size):
+            least = np.sort(approved[voters])[:required]        # the least satisfied voters form the worst group
+            degree = min(degree, float(least.mean()) / len(projects))
+        return degree
+
+
+def utalitarian_welfare(election, projects):
     """Return the utilitarian welfare of a list of satisfactions."""
-    if len(projects) == 0:
-        return 0
-    total = 0
-    for person in persons:
-        total += sum([a for project, a in person.project_approvals.items() if project.instance in projects])
-    
-    return total / (len(persons) * len(projects))
-
-def chamberlin_courant_welfare(persons, projects):
+    return WelfareEvaluator(election).evaluate({"outcome": projects}, ["utalitarian"])["outcome"]["utalitarian"]
+
+def chamberlin_courant_welfare(election, projects):
     """Return the Chamberlin-Courant welfare of a list of satisfactions."""
-    if len(projects) == 0:
-        return 0
-    total = 0
-    for person in persons:
-        total += max([a for project, a in person.project_approvals.items() if project.instance in projects])
-    return total / len(persons)
-
-def egalitarian_social_welfare(persons, projects):
+    return WelfareEvaluator(election).evaluate({"outcome": projects}, ["chamberlin"])["outcome"]["chamberlin"]
+
+def egalitarian_social_welfare(election, projects):
     """Return the egalitarian social welfare of a list of satisfactions."""
-    if len(projects) == 0:
-        return 0
-    approvals = []
-    for person in persons:
-        approvals.append(sum([a for project, a in person.project_approvals.items() if project.instance in projects]))
-    return min(approvals)
-
-def nash_welfare(persons, projects):
+    return WelfareEvaluator(election).evaluate({"outcome": projects}, ["egalitarian"])["outcome"]["egalitarian"]
+
+def nash_welfare(election, projects):
     """Return the Nash welfare of a list of satisfactions."""
-    if len(projects) == 0:
-        return 0
-    total = 1
-    for person in persons:
-        approval = sum([a for project, a in person.project_approvals.items() if project.instance in projects])  
-        total *= min(1, approval)
-    return total
+    return WelfareEvaluator(election).evaluate({"outcome": projects}, ["nash"])["outcome"]["nash"]
+
+def log_nash_welfare(election, projects, epsilon=1e-9):
+    """Return the log-space Nash welfare (LogNash) of a list of satisfactions."""
+    return WelfareEvaluator(election, epsilon).nash({"outcome": projects})["outcome"]